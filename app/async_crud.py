@@ -0,0 +1,220 @@
+"""Асинхронные версии функций ``crud`` для бота (AsyncSession, asyncpg).
+
+Связанные объекты загружаются явно (``joinedload``/``selectinload``):
+ленивая загрузка в асинхронной сессии недоступна, а в списках она
+давала бы N+1 запросов.
+"""
+from datetime import datetime, timezone
+
+import json
+from dataclasses import asdict, dataclass
+
+from sqlalchemy import func, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, joinedload
+
+from . import models, student_cache
+
+
+def _utcnow():
+    """Текущее время для сравнения с lessons.start (timestamptz)."""
+    return datetime.now(timezone.utc)
+
+
+async def get_student_by_id(db: AsyncSession, student_id: int):
+    return await db.get(models.Student, student_id)
+
+
+async def create_tg_link(db: AsyncSession, tg_user_id: str, student_id: int):
+    link = await db.scalar(
+        select(models.TgLink).filter_by(tg_user_id=str(tg_user_id), student_id=student_id).limit(1)
+    )
+    if link:
+        return link
+    link = models.TgLink(tg_user_id=str(tg_user_id), student_id=student_id)
+    db.add(link)
+    await db.commit()
+    return link
+
+
+async def get_lesson(db: AsyncSession, lesson_id: int):
+    return await db.get(models.Lesson, lesson_id)
+
+
+async def get_lessons_notification(db: AsyncSession, lesson_ids):
+    """Уроки вместе с учениками и их привязками Telegram — одним запросом.
+
+    Всё, что нужно для уведомления: ``lesson.student`` и
+    ``lesson.student.tg_links`` уже загружены. Порядок — по времени начала;
+    ненайденные id просто отсутствуют в результате.
+    """
+    result = await db.execute(
+        select(models.Lesson)
+        .options(joinedload(models.Lesson.student).joinedload(models.Student.tg_links))
+        .where(models.Lesson.id.in_(list(lesson_ids)))
+        .order_by(models.Lesson.start, models.Lesson.id)
+    )
+    return result.unique().scalars().all()
+
+
+async def get_student_by_tg_user_id(db: AsyncSession, tg_user_id: str):
+    return await db.scalar(
+        select(models.Student)
+        .join(models.TgLink, models.TgLink.student_id == models.Student.id)
+        .where(models.TgLink.tg_user_id == tg_user_id)
+        .limit(1)
+    )
+
+
+@dataclass(frozen=True)
+class StudentPage:
+    students: list  # list[student_cache.StudentRow]
+    has_prev: bool
+    has_next: bool
+
+
+def _encode_page(page: StudentPage) -> str:
+    return json.dumps(
+        {"students": [asdict(row) for row in page.students], "has_prev": page.has_prev, "has_next": page.has_next}
+    )
+
+
+def _decode_page(raw) -> StudentPage:
+    data = json.loads(raw)
+    return StudentPage(
+        [student_cache.StudentRow(**row) for row in data["students"]],
+        has_prev=data["has_prev"],
+        has_next=data["has_next"],
+    )
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def list_students_page(
+    db: AsyncSession,
+    limit: int,
+    cursor_id: int | None = None,
+    direction: str = "next",
+    prefix: str | None = None,
+) -> StudentPage:
+    """Страница учеников по алфавиту (keyset по ``(summary, id)``) — один запрос.
+
+    cursor_id — ученик, от которого листаем: ``next`` — строго после него,
+    ``prev`` — строго перед ним, ``from`` — начиная с него. Позиция курсора
+    берётся в том же запросе (join по id), поэтому в callback достаточно id.
+    prefix — фильтр по началу имени без учёта регистра.
+
+    Страницы читаются через ``student_cache`` и сбрасываются любой записью в учеников.
+    """
+    prefix = prefix.lower() if prefix else ""
+    key = f"page:{limit}:{direction}:{cursor_id}:{prefix}"
+    return await student_cache.aget(
+        key,
+        lambda: _load_students_page(db, limit, cursor_id, direction, prefix),
+        encode=_encode_page,
+        decode=_decode_page,
+    )
+
+
+async def _load_students_page(db: AsyncSession, limit: int, cursor_id, direction: str, prefix: str) -> StudentPage:
+    key = tuple_(models.Student.summary, models.Student.id)
+    query = select(models.Student)
+    if prefix:
+        query = query.where(
+            func.lower(models.Student.summary).like(_escape_like(prefix) + "%", escape="\\")
+        )
+    if cursor_id is not None:
+        cursor = aliased(models.Student)
+        cursor_key = tuple_(cursor.summary, cursor.id)
+        query = query.join(cursor, cursor.id == cursor_id)
+        if direction == "prev":
+            query = query.where(key < cursor_key)
+        elif direction == "from":
+            query = query.where(key >= cursor_key)
+        else:
+            query = query.where(key > cursor_key)
+
+    backward = cursor_id is not None and direction == "prev"
+    if backward:
+        query = query.order_by(models.Student.summary.desc(), models.Student.id.desc())
+    else:
+        query = query.order_by(models.Student.summary, models.Student.id)
+    students = list((await db.scalars(query.limit(limit + 1))).all())
+    more = len(students) > limit
+    students = students[:limit]
+    if backward:
+        students.reverse()
+        return StudentPage(student_cache.rows_from_models(students), has_prev=more, has_next=True)
+    return StudentPage(student_cache.rows_from_models(students), has_prev=cursor_id is not None, has_next=more)
+
+
+async def toggle_student_active_status(db: AsyncSession, student_id: int):
+    """Переключить статус активности ученика"""
+    student = await db.get(models.Student, student_id)
+    if student:
+        student.is_active = not student.is_active
+        await db.commit()
+        await student_cache.ainvalidate()
+        return student
+    return None
+
+
+def _paid_lessons_update(student_id: int, value):
+    return (
+        update(models.Student)
+        .where(models.Student.id == student_id)
+        .values(paid_lessons_count=value)
+        .returning(models.Student.id, models.Student.summary, models.Student.paid_lessons_count)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def update_student_paid_lessons(db: AsyncSession, student_id: int, paid_lessons_count: int):
+    """Установить количество оплаченных занятий одним UPDATE ... RETURNING.
+
+    Returns: строка (id, summary, paid_lessons_count) или None, если ученика нет.
+    """
+    row = (await db.execute(_paid_lessons_update(student_id, paid_lessons_count))).one_or_none()
+    await db.commit()
+    if row is not None:
+        await student_cache.ainvalidate()
+    return row
+
+
+async def change_student_paid_lessons(db: AsyncSession, student_id: int, delta: int):
+    """Изменить количество оплаченных занятий на ``delta`` (не ниже нуля).
+
+    Новое значение считает сама база (``GREATEST(paid_lessons_count + delta, 0)``),
+    поэтому одновременные нажатия администратора и списания Celery не теряют
+    изменений. Returns: как ``update_student_paid_lessons``.
+    """
+    value = func.greatest(models.Student.paid_lessons_count + delta, 0)
+    row = (await db.execute(_paid_lessons_update(student_id, value))).one_or_none()
+    await db.commit()
+    if row is not None:
+        await student_cache.ainvalidate()
+    return row
+
+
+async def get_upcoming_lessons(db: AsyncSession, limit: int = 10):
+    """Получить список предстоящих уроков вместе с учениками"""
+    now = _utcnow()
+    return (
+        await db.scalars(
+            select(models.Lesson)
+            .options(joinedload(models.Lesson.student))
+            .where(models.Lesson.start >= now)
+            .order_by(models.Lesson.start)
+            .limit(limit)
+        )
+    ).all()
+
+
+async def get_lessons_for_student(db: AsyncSession, student_id: int, upcoming_only: bool = True, limit: int = 10):
+    """Получить уроки для конкретного ученика"""
+    query = select(models.Lesson).where(models.Lesson.student_id == student_id)
+    if upcoming_only:
+        query = query.where(models.Lesson.start >= _utcnow())
+    return (await db.scalars(query.order_by(models.Lesson.start).limit(limit))).all()
@@ -1,5 +1,19 @@
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
+
+class CalDAVCalendarConfig(BaseModel):
+    """Один опрашиваемый календарь (элемент CALDAV_ACCOUNTS)."""
+
+    email: str
+    password: str
+    calendar: str = "Мои события"
+    website: str = "https://caldav.yandex.ru/"
+    # Если не заданы — берутся WORKER_POLL_SECONDS / CALDAV_TIMEOUT_SECONDS
+    poll_seconds: int | None = None
+    timeout_seconds: int | None = None
+
+
 class Settings(BaseSettings):
     POSTGRES_DB: str
     POSTGRES_USER: str
@@ -8,12 +22,97 @@ class Settings(BaseSettings):
     REDIS_URL: str
     TG_BOT_TOKEN: str
     ADMIN_TELEGRAM_ID: int
-    CALDAV_EMAIL: str
-    CALDAV_PASSWORD: str
+    CALDAV_EMAIL: str = ""
+    CALDAV_PASSWORD: str = ""
     CALDAV_WEBSITE: str = "https://caldav.yandex.ru/"
+    CALDAV_CALENDAR: str = "Мои события"
+    # JSON-список календарей для опроса; если пуст — один календарь из CALDAV_EMAIL/CALDAV_PASSWORD
+    CALDAV_ACCOUNTS: list[CalDAVCalendarConfig] = []
+    CALDAV_TIMEOUT_SECONDS: int = 60
+    CALDAV_POOL_SIZE: int = 4
+    # Часовой пояс преподавателя (тихие часы worker, отображение времени)
+    TIMEZONE: str = "Europe/Moscow"
+    # Базовый интервал опроса; реальный подбирается по ближайшему уроку
     WORKER_POLL_SECONDS: int = 600
+    WORKER_POLL_MIN_SECONDS: int = 60
+    WORKER_POLL_MAX_SECONDS: int = 3600
+    # Урок ближе этого — опрашиваем с интервалом WORKER_POLL_MIN_SECONDS
+    WORKER_POLL_SOON_SECONDS: int = 3600
+    # Тихие часы (локальное время TIMEZONE, "начало-конец"), пустая строка — отключить
+    WORKER_QUIET_HOURS: str = "0-7"
+    # Пауза, за которую серия запросов «синхронизировать сейчас» сливается в один опрос
+    WORKER_SYNC_DEBOUNCE_SECONDS: float = 5.0
+    # Первая задержка после ошибки CalDAV; дальше удваивается (со случайным разбросом)
+    WORKER_ERROR_BACKOFF_SECONDS: int = 30
+    # Сколько календарей worker опрашивает одновременно
+    WORKER_MAX_CONCURRENCY: int = 4
+    # incremental — CTag/sync-token/ETag, search — полный поиск по окну каждый цикл
+    WORKER_SYNC_MODE: str = "incremental"
+    # LRU-кэш разобранных событий (href+ETag -> EventSpec), опционально дублируется в Redis
+    WORKER_EVENT_CACHE_SIZE: int = 2048
+    WORKER_EVENT_CACHE_REDIS: bool = False
+    # Кэш списка учеников: TTL в памяти процесса; с Redis изменения из других процессов видны сразу
+    STUDENT_CACHE_TTL_SECONDS: int = 60
+    STUDENT_CACHE_REDIS: bool = True
+    # Кэш ответов /lessons в Redis (сбрасывается при изменениях, это — верхняя граница жизни)
+    LESSONS_VIEW_TTL_SECONDS: int = 3600
+    # Списание за завершённые уроки: период, глубина просмотра назад (часы), уроков за один проход
+    SETTLE_INTERVAL_SECONDS: int = 60
+    SETTLE_LOOKBACK_HOURS: int = 48
+    SETTLE_BATCH_SIZE: int = 500
+    # Как часто напоминать админу о неоплаченных уроках старше SETTLE_LOOKBACK_HOURS (сек)
+    SETTLE_OVERDUE_REPORT_SECONDS: int = 86400
+    # Диспетчер очереди отложенных задач (Redis ZSET)
+    DISPATCHER_INTERVAL_SECONDS: float = 1.0
+    DISPATCHER_BATCH_SIZE: int = 100
+    # Срок аренды забранных элементов: не подтверждённые за это время возвращаются в очередь
+    DISPATCHER_LEASE_SECONDS: int = 60
+    # Напоминания, срабатывающие в одном окне, отправляются одним запросом /notify_batch
+    NOTIFY_BATCH_WINDOW_SECONDS: int = 60
+    # API бота для Celery: адрес, размер пула keep-alive соединений на процесс, таймауты (сек)
+    BOT_BASE_URL: str = "http://bot:8080"
+    BOT_HTTP_POOL_SIZE: int = 10
+    BOT_HTTP_CONNECT_TIMEOUT: float = 3.0
+    BOT_HTTP_READ_TIMEOUT: float = 30.0
+    # Доставка уведомлений из Celery в бота: stream — Redis Streams, http — POST в API бота
+    NOTIFY_TRANSPORT: str = "stream"
+    # Потребитель потока в боте: размер пачки, через сколько забирать неподтверждённые записи,
+    # после скольких доставок запись отбрасывается; примерный предел длины потока
+    NOTIFY_STREAM_BATCH_SIZE: int = 50
+    NOTIFY_STREAM_CLAIM_IDLE_SECONDS: int = 60
+    NOTIFY_STREAM_MAX_DELIVERIES: int = 5
+    NOTIFY_STREAM_MAXLEN: int = 10000
+    # Получение обновлений ботом: polling (один процесс, для разработки) или webhook
+    BOT_MODE: str = "polling"
+    # Публичный адрес бота для webhook (https://example.com), путь и секрет (X-Telegram-Bot-Api-Secret-Token, обязателен)
+    BOT_WEBHOOK_URL: str = ""
+    BOT_WEBHOOK_PATH: str = "/telegram/webhook"
+    BOT_WEBHOOK_SECRET: str = ""
+    # Сколько живёт незавершённый диалог администратора (FSM в Redis), секунд
+    BOT_FSM_TTL_SECONDS: int = 600
+    # Отправка сообщений ботом: параллельных запросов, сообщений/сек всего и в один чат
+    BOT_SEND_CONCURRENCY: int = 10
+    BOT_SEND_GLOBAL_RATE: float = 25.0
+    BOT_SEND_CHAT_RATE: float = 1.0
+    # Сколько раз повторять отправку после flood control (TelegramRetryAfter)
+    BOT_SEND_MAX_RETRIES: int = 3
 
     class Config:
         env_file = ".env"
 
+    def caldav_calendars(self) -> list[CalDAVCalendarConfig]:
+        """Все календари, которые должен опрашивать worker."""
+        if self.CALDAV_ACCOUNTS:
+            return list(self.CALDAV_ACCOUNTS)
+        if not self.CALDAV_EMAIL:
+            return []
+        return [
+            CalDAVCalendarConfig(
+                email=self.CALDAV_EMAIL,
+                password=self.CALDAV_PASSWORD,
+                calendar=self.CALDAV_CALENDAR,
+                website=self.CALDAV_WEBSITE,
+            )
+        ]
+
 settings = Settings()
@@ -1,5 +1,15 @@
-from sqlalchemy.orm import Session
-from . import models
+import hashlib
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, joinedload
+from . import models, student_cache
+
+# Размер пачки для INSERT ... ON CONFLICT при массовой сверке уроков
+_RECONCILE_BATCH_SIZE = 500
 
 
 def get_student_by_id(db: Session, student_id: int):
@@ -14,42 +24,137 @@ def get_or_create_student(db: Session, summary: str):
     db.add(s)
     db.commit()
     db.refresh(s)
+    student_cache.invalidate()
     return s
 
 
-def upsert_lesson(
-    db: Session, event_uid: str, summary: str, start, end, student: models.Student
-):
-    l = db.query(models.Lesson).filter_by(event_uid=event_uid).first()
-    if l:
-        changed = False
-        if (
-            l.start != start
-            or l.end != end
-            or l.summary != summary
-            or l.student_id != student.id
-        ):
-            l.start = start
-            l.end = end
-            l.summary = summary
-            l.student = student
-            changed = True
-        if changed:
-            db.add(l)
-            db.commit()
-            db.refresh(l)
-        return l, changed
-    l = models.Lesson(
-        event_uid=event_uid,
-        summary=summary,
-        start=start,
-        end=end,
-        student=student,
-    )
-    db.add(l)
+def lesson_fingerprint(event_uid: str, summary: str, start, end, student_id) -> str:
+    """Отпечаток содержимого урока: sha256 от UID, начала и конца в UTC, названия и ученика.
+
+    Время приводится к UTC (naive считается UTC), поэтому одно и то же
+    событие даёт одинаковый отпечаток независимо от зоны, в которой его
+    вернули icalendar или драйвер БД.
+    """
+    parts = [event_uid, _utc_iso(start), _utc_iso(end), summary or "", str(student_id)]
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+def _utc_iso(value) -> str:
+    if value is None:
+        return ""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat()
+
+
+def get_or_create_students(db: Session, summaries) -> dict[str, int]:
+    """Найти или создать учеников по summary; вернуть {summary: id}.
+
+    Не коммитит — вызывается внутри транзакции reconcile_lessons; если
+    ученики были созданы, в ``db.info`` ставится флаг ``students_changed``
+    (кэш списка сбрасывается после commit).
+    """
+    wanted = set(summaries)
+    if not wanted:
+        return {}
+    rows = db.execute(
+        select(models.Student.summary, models.Student.id).where(models.Student.summary.in_(wanted))
+    ).all()
+    ids = dict(rows)
+    missing = wanted - ids.keys()
+    if missing:
+        stmt = (
+            pg_insert(models.Student)
+            .values([{"summary": summary} for summary in sorted(missing)])
+            .on_conflict_do_nothing(index_elements=["summary"])
+            .returning(models.Student.summary, models.Student.id)
+        )
+        created = dict(db.execute(stmt).all())
+        if created:
+            db.info["students_changed"] = True
+        ids.update(created)
+        # Ученика мог параллельно создать другой процесс
+        raced = missing - ids.keys()
+        if raced:
+            rows = db.execute(
+                select(models.Student.summary, models.Student.id).where(models.Student.summary.in_(raced))
+            ).all()
+            ids.update(dict(rows))
+    return ids
+
+
+def reconcile_lessons(db: Session, occurrences):
+    """Сверить вхождения событий с таблицей lessons за одну транзакцию.
+
+    occurrences: iterable of (event_uid, summary, start, end).
+    Существующие уроки читаются одним запросом, изменённые и новые строки
+    пишутся пачками INSERT ... ON CONFLICT (event_uid) DO UPDATE. Урок
+    считается изменённым, только если не совпал его ``lesson_fingerprint``:
+    опрос без изменений в календаре ничего не пишет.
+
+    Returns: ({event_uid: lesson_id}, {id изменённых или созданных уроков},
+              {id учеников, чьи уроки изменились — прежних и новых владельцев})
+    """
+    # При дублях UID (например, исключение из серии) побеждает последнее вхождение
+    by_uid = {uid: (uid, summary, start, end) for uid, summary, start, end in occurrences}
+    if not by_uid:
+        return {}, set(), set()
+
+    student_ids = get_or_create_students(db, {summary for _, summary, _, _ in by_uid.values()})
+    existing = db.execute(
+        select(
+            models.Lesson.event_uid,
+            models.Lesson.id,
+            models.Lesson.fingerprint,
+            models.Lesson.student_id,
+        ).where(models.Lesson.event_uid.in_(by_uid.keys()))
+    ).all()
+    existing_by_uid = {row.event_uid: row for row in existing}
+
+    lesson_ids = {row.event_uid: row.id for row in existing}
+    changed_ids: set[int] = set()
+    changed_student_ids: set[int] = set()
+    pending = []
+    for uid, summary, start, end in by_uid.values():
+        student_id = student_ids[summary]
+        row = existing_by_uid.get(uid)
+        fingerprint = lesson_fingerprint(uid, summary, start, end, student_id)
+        if row is not None and row.fingerprint == fingerprint:
+            continue
+        changed_student_ids.add(student_id)
+        if row is not None and row.student_id is not None:
+            changed_student_ids.add(row.student_id)
+        pending.append(
+            {
+                "event_uid": uid,
+                "summary": summary,
+                "start": start,
+                "end": end,
+                "student_id": student_id,
+                "fingerprint": fingerprint,
+            }
+        )
+
+    for offset in range(0, len(pending), _RECONCILE_BATCH_SIZE):
+        stmt = pg_insert(models.Lesson).values(pending[offset:offset + _RECONCILE_BATCH_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["event_uid"],
+            set_={
+                "summary": stmt.excluded.summary,
+                "start": stmt.excluded.start,
+                "end": stmt.excluded.end,
+                "student_id": stmt.excluded.student_id,
+                "fingerprint": stmt.excluded.fingerprint,
+            },
+        ).returning(models.Lesson.event_uid, models.Lesson.id)
+        for uid, lesson_id in db.execute(stmt).all():
+            lesson_ids[uid] = lesson_id
+            changed_ids.add(lesson_id)
+
     db.commit()
-    db.refresh(l)
-    return l, True
+    if db.info.pop("students_changed", False):
+        student_cache.invalidate()
+    return lesson_ids, changed_ids, changed_student_ids
 
 
 def create_tg_link(db: Session, tg_user_id: str, student_id: int):
@@ -95,20 +200,24 @@ def toggle_student_active_status(db: Session, student_id: int):
         db.add(student)
         db.commit()
         db.refresh(student)
+        student_cache.invalidate()
         return student
     return None
 
 
 def update_student_paid_lessons(db: Session, student_id: int, paid_lessons_count: int):
-    """Обновить количество оплаченных занятий"""
-    student = db.query(models.Student).filter_by(id=student_id).first()
-    if student:
-        student.paid_lessons_count = paid_lessons_count
-        db.add(student)
-        db.commit()
-        db.refresh(student)
-        return student
-    return None
+    """Установить количество оплаченных занятий одним UPDATE ... RETURNING"""
+    row = db.execute(
+        update(models.Student)
+        .where(models.Student.id == student_id)
+        .values(paid_lessons_count=paid_lessons_count)
+        .returning(models.Student.id, models.Student.summary, models.Student.paid_lessons_count)
+        .execution_options(synchronize_session=False)
+    ).one_or_none()
+    db.commit()
+    if row is not None:
+        student_cache.invalidate()
+    return row
 
 
 def mark_lesson_paid(db: Session, lesson_id: int, is_paid: bool = True):
@@ -123,24 +232,114 @@ def mark_lesson_paid(db: Session, lesson_id: int, is_paid: bool = True):
     return None
 
 
-def deduct_paid_lesson(db: Session, student_id: int):
-    """Списать одно оплаченное занятие у ученика (если есть)"""
-    student = db.query(models.Student).filter_by(id=student_id).first()
-    if student and student.paid_lessons_count > 0:
-        student.paid_lessons_count -= 1
-        db.add(student)
-        db.commit()
-        db.refresh(student)
-        return student
-    return None
+@dataclass
+class SettleResult:
+    """Итог списания за завершённые уроки."""
+    lesson_ids: list[int] = field(default_factory=list)
+    # Ученики отмеченных уроков
+    student_ids: set[int] = field(default_factory=set)
+    # student_id -> сколько занятий списано
+    deducted: dict[int, int] = field(default_factory=dict)
+    # (summary ученика, [названия уроков, за которые не хватило оплаченных занятий])
+    exhausted: list[tuple[str, list[str]]] = field(default_factory=list)
+
+
+def settle_completed_lessons(
+    db: Session,
+    lookback: timedelta,
+    limit: int,
+    lesson_ids=None,
+) -> SettleResult:
+    """Отметить оплаченными завершённые уроки и списать занятия — одной транзакцией.
+
+    Берутся неоплаченные уроки, закончившиеся за последние ``lookback``
+    (или только ``lesson_ids``), ``FOR UPDATE SKIP LOCKED``: параллельный
+    запуск пропустит уже захваченные строки, а повторный не найдёт уже
+    оплаченных — двойного списания нет. Балансы учеников блокируются и
+    уменьшаются не ниже нуля; тем, у кого занятий не хватило, отвечает
+    ``SettleResult.exhausted``.
+    """
+    now = datetime.now(timezone.utc)
+    query = (
+        select(models.Lesson.id, models.Lesson.student_id, models.Lesson.summary)
+        .where(
+            models.Lesson.is_paid.is_not(True),
+            models.Lesson.end <= now,
+            models.Lesson.end > now - lookback,
+        )
+        .order_by(models.Lesson.end)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    if lesson_ids is not None:
+        query = query.where(models.Lesson.id.in_(list(lesson_ids)))
+    lessons = db.execute(query).all()
+    result = SettleResult()
+    if not lessons:
+        db.rollback()
+        return result
+
+    result.lesson_ids = [lesson.id for lesson in lessons]
+    db.execute(
+        update(models.Lesson)
+        .where(models.Lesson.id.in_(result.lesson_ids))
+        .values(is_paid=True)
+        .execution_options(synchronize_session=False)
+    )
+
+    per_student = Counter(lesson.student_id for lesson in lessons if lesson.student_id is not None)
+    result.student_ids = set(per_student)
+    students = db.execute(
+        select(models.Student.id, models.Student.summary, models.Student.paid_lessons_count)
+        .where(models.Student.id.in_(per_student))
+        .order_by(models.Student.id)
+        .with_for_update()
+    ).all()
+    changes = []
+    for student in students:
+        balance = student.paid_lessons_count or 0
+        due = per_student[student.id]
+        deducted = min(balance, due)
+        if deducted:
+            result.deducted[student.id] = deducted
+            changes.append({"id": student.id, "paid_lessons_count": balance - deducted})
+        if deducted < due:
+            unpaid = [lesson.summary for lesson in lessons if lesson.student_id == student.id][deducted:]
+            result.exhausted.append((student.summary, unpaid))
+    if changes:
+        db.execute(update(models.Student), changes)
+    db.commit()
+    if changes:
+        student_cache.invalidate()
+    return result
+
+
+def find_overdue_unpaid_lessons(db: Session, lookback: timedelta, sample: int = 10) -> tuple[int, list[str]]:
+    """Неоплаченные уроки, закончившиеся раньше окна ``lookback``.
+
+    ``settle_completed_lessons`` их уже не возьмёт (например, списание не
+    работало дольше ``lookback``), поэтому о них нужно сообщить администратору.
+    Returns: (число уроков, названия последних ``sample`` по времени окончания).
+    """
+    conditions = (
+        models.Lesson.is_paid.is_not(True),
+        models.Lesson.end <= datetime.now(timezone.utc) - lookback,
+    )
+    count = db.scalar(select(func.count()).select_from(models.Lesson).where(*conditions))
+    if not count:
+        return 0, []
+    titles = db.scalars(
+        select(models.Lesson.summary).where(*conditions).order_by(models.Lesson.end.desc()).limit(sample)
+    ).all()
+    return count, list(titles)
 
 
 def get_upcoming_lessons(db: Session, limit: int = 10):
-    """Получить список предстоящих уроков, отсортированных по времени начала"""
-    from datetime import datetime, timezone
+    """Получить список предстоящих уроков (вместе с учениками), отсортированных по времени начала"""
     now = datetime.now(timezone.utc)
     return (
         db.query(models.Lesson)
+        .options(joinedload(models.Lesson.student))
         .filter(models.Lesson.start >= now)
         .order_by(models.Lesson.start)
         .limit(limit)
@@ -150,7 +349,6 @@ def get_upcoming_lessons(db: Session, limit: int = 10):
 
 def get_lessons_for_student(db: Session, student_id: int, upcoming_only: bool = True, limit: int = 10):
     """Получить уроки для конкретного ученика"""
-    from datetime import datetime, timezone
     query = db.query(models.Lesson).filter(models.Lesson.student_id == student_id)
     
     if upcoming_only:
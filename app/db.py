@@ -1,7 +1,29 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
 from .config import settings
 
 engine = create_engine(settings.DATABASE_URL, future=True)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 Base = declarative_base()
+
+
+def async_database_url(url: str = settings.DATABASE_URL) -> str:
+    """Тот же DATABASE_URL, но с драйвером asyncpg."""
+    return make_url(url).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+
+
+def __getattr__(name: str):
+    """Асинхронный движок (``async_engine``, ``AsyncSessionLocal``) создаётся при первом обращении.
+
+    asyncpg нужен только боту; worker и celery импортируют этот модуль без него.
+    """
+    if name not in ("async_engine", "AsyncSessionLocal"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(async_database_url(), pool_pre_ping=True)
+    # expire_on_commit=False: атрибуты объектов доступны после commit без ленивой загрузки
+    globals()["async_engine"] = async_engine
+    globals()["AsyncSessionLocal"] = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    return globals()[name]
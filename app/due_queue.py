@@ -0,0 +1,177 @@
+"""Очередь отложенных задач на Redis sorted set вместо Celery-задач с ETA.
+
+Элемент — ``<kind>:<lesson_id>:<version>``, score — время срабатывания;
+задача с устаревшей версией расписания (``schedule_versions``) не выполняется.
+"""
+from datetime import datetime, timezone
+
+DUE_QUEUE_KEY = "due_queue"
+INFLIGHT_KEY = "due_queue:inflight"
+SCHEDULE_VERSIONS_KEY = "schedule_versions"
+# Общий счётчик версий: версия никогда не повторяется, даже после удаления поля
+VERSION_SEQUENCE_KEY = "schedule_versions:seq"
+
+# kind -> имя задачи Celery
+TASKS_BY_KIND = {
+    "notify": "tasks.send_notify",
+    # Новые элементы не ставятся (списание — периодическая tasks.settle_completed_lessons),
+    # вид оставлен для элементов, поставленных ранее
+    "deduct": "tasks.deduct_lesson_after_completion",
+}
+# Задача для пачки напоминаний из одного окна
+NOTIFY_BATCH_TASK = "tasks.send_notify_batch"
+
+# Атомарно перенести до ARGV[2] элементов со score <= ARGV[1] в KEYS[2] со score ARGV[3]
+_POP_DUE_SCRIPT = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, ARGV[2])
+for i = 1, #items, 2 do
+    redis.call('ZREM', KEYS[1], items[i])
+    redis.call('ZADD', KEYS[2], ARGV[3], items[i])
+end
+return items
+"""
+
+# Вернуть из KEYS[2] в KEYS[1] элементы с истёкшей арендой (score <= ARGV[1]);
+# элемент, который worker за это время поставил заново, не трогается
+_REQUEUE_EXPIRED_SCRIPT = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for i = 1, #items do
+    redis.call('ZREM', KEYS[2], items[i])
+    redis.call('ZADD', KEYS[1], 'NX', ARGV[1], items[i])
+end
+return #items
+"""
+
+
+# Удалить поля KEYS[1] из пар (ARGV[2i-1] поле, ARGV[2i] версия), если версия всё ещё текущая
+_CONSUME_SCRIPT = """
+local removed = 0
+for i = 1, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        removed = removed + redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+return removed
+"""
+
+
+def make_member(kind: str, lesson_id: int, version) -> str:
+    return f"{kind}:{lesson_id}:{version}"
+
+
+def parse_member(member) -> tuple[str, int, str]:
+    if isinstance(member, bytes):
+        member = member.decode()
+    kind, lesson_id, version = member.split(":", 2)
+    return kind, int(lesson_id), version
+
+
+def next_versions(r, count: int) -> list[int]:
+    """Выделить ``count`` новых версий расписания (строго больше всех выданных)."""
+    if count <= 0:
+        return []
+    last = int(r.incrby(VERSION_SEQUENCE_KEY, count))
+    return list(range(last - count + 1, last + 1))
+
+
+def version_field(kind: str, lesson_id: int) -> str:
+    return f"{kind}:{lesson_id}"
+
+
+def is_current_version(r, kind: str, lesson_id: int, version: int | None) -> bool:
+    """Актуальна ли задача с данной версией расписания.
+
+    Задачи без версии (поставленные до появления версий) актуальны, только
+    пока урок ни разу не перепланировался через очередь. Задача с версией
+    неактуальна и тогда, когда поля нет: его удалила уже выполненная задача
+    или списание за урок.
+    """
+    return _matches(r.hget(SCHEDULE_VERSIONS_KEY, version_field(kind, lesson_id)), version)
+
+
+def _matches(current, version) -> bool:
+    if current is None:
+        return version is None
+    return version is not None and int(current) == int(version)
+
+
+def current_versions(r, kind: str, items) -> list[tuple[int, int | None]]:
+    """Оставить из [(lesson_id, version), ...] только актуальные (одним запросом)."""
+    items = list(items)
+    if not items:
+        return []
+    fields = [version_field(kind, lesson_id) for lesson_id, _ in items]
+    current = r.hmget(SCHEDULE_VERSIONS_KEY, fields)
+    return [item for item, cur in zip(items, current) if _matches(cur, item[1])]
+
+
+def consume_versions(r, kind: str, items) -> int:
+    """Удалить поля версий выполненных задач [(lesson_id, version), ...].
+
+    Поле удаляется, только если версия в нём всё ещё та же: перепланированный
+    за это время урок сохраняет новую версию.
+    """
+    args = []
+    for lesson_id, version in items:
+        if version is not None:
+            args += [version_field(kind, lesson_id), str(int(version))]
+    if not args:
+        return 0
+    return int(r.eval(_CONSUME_SCRIPT, 1, SCHEDULE_VERSIONS_KEY, *args))
+
+
+def forget_lessons(r, lesson_ids) -> None:
+    """Удалить поля версий всех видов для уроков (урок завершён и оплачен)."""
+    fields = [version_field(kind, lesson_id) for lesson_id in set(lesson_ids) for kind in TASKS_BY_KIND]
+    if fields:
+        r.hdel(SCHEDULE_VERSIONS_KEY, *fields)
+
+
+def bucket_start(fire_at: datetime, window_seconds: int) -> datetime:
+    """Округлить время вниз до начала окна группировки."""
+    if window_seconds <= 1:
+        return fire_at
+    ts = fire_at.timestamp()
+    return datetime.fromtimestamp(ts - ts % window_seconds, tz=timezone.utc)
+
+
+def schedule(pipe, member: str, fire_at: datetime, old_member=None) -> None:
+    """Добавить (или перенести) элемент очереди; команды пишутся в pipeline."""
+    if isinstance(old_member, bytes):
+        old_member = old_member.decode()
+    if old_member and old_member != member:
+        pipe.zrem(DUE_QUEUE_KEY, old_member)
+    pipe.zadd(DUE_QUEUE_KEY, {member: fire_at.timestamp()})
+
+
+def pop_due(r, now_ts: float, limit: int, lease_seconds: float) -> list[tuple[str, float]]:
+    """Забрать наступившие элементы в аренду до ``now_ts + lease_seconds``: [(member, score), ...].
+
+    После отправки в Celery элементы нужно подтвердить (``ack``), иначе по
+    истечении аренды они вернутся в очередь.
+    """
+    items = r.eval(_POP_DUE_SCRIPT, 2, DUE_QUEUE_KEY, INFLIGHT_KEY, now_ts, limit, now_ts + lease_seconds)
+    return [
+        (items[i].decode() if isinstance(items[i], bytes) else items[i], float(items[i + 1]))
+        for i in range(0, len(items), 2)
+    ]
+
+
+def ack(r, items: list[tuple[str, float]]) -> None:
+    """Снять аренду с элементов, задачи для которых поставлены в Celery."""
+    if items:
+        r.zrem(INFLIGHT_KEY, *[member for member, _ in items])
+
+
+def requeue(r, items: list[tuple[str, float]]) -> None:
+    """Вернуть арендованные элементы в очередь (например, если отправка в Celery не удалась)."""
+    if items:
+        pipe = r.pipeline()
+        pipe.zrem(INFLIGHT_KEY, *[member for member, _ in items])
+        pipe.zadd(DUE_QUEUE_KEY, {member: score for member, score in items})
+        pipe.execute()
+
+
+def requeue_expired(r, now_ts: float) -> int:
+    """Вернуть в очередь элементы, аренда которых истекла (диспетчер упал до ``ack``)."""
+    return int(r.eval(_REQUEUE_EXPIRED_SCRIPT, 2, DUE_QUEUE_KEY, INFLIGHT_KEY, now_ts))
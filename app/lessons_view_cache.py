@@ -0,0 +1,102 @@
+"""Кэш отрисованных списков предстоящих уроков (команда /lessons) в Redis.
+
+Запись сбрасывается при изменении уроков и оплат, а живёт не дольше начала
+первого урока в списке.
+"""
+import logging
+from datetime import datetime, timezone
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+ADMIN_KEY = "lessons_view:admin"
+GENERATION_KEY = "lessons_view:gen"
+
+# SET KEYS[2] ARGV[2] EX ARGV[3], только если поколение KEYS[1] всё ещё ARGV[1]
+_STORE_SCRIPT = """
+if (redis.call('GET', KEYS[1]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+def student_key(student_id: int) -> str:
+    return f"lessons_view:student:{student_id}"
+
+
+def tg_student_key(tg_user_id: str) -> str:
+    """Привязка Telegram-пользователя к ученику (привязки только добавляются)."""
+    return f"lessons_view:tg:{tg_user_id}"
+
+
+def _keys(student_ids, admin: bool) -> list[str]:
+    keys = [student_key(student_id) for student_id in set(student_ids) if student_id is not None]
+    if admin:
+        keys.append(ADMIN_KEY)
+    return keys
+
+
+def invalidate(r, student_ids=(), admin: bool = True) -> None:
+    """Сбросить списки уроков учеников ``student_ids`` (и администратора)."""
+    keys = _keys(student_ids, admin)
+    if not keys:
+        return
+    try:
+        # Сначала поколение: запись, начатая до сброса, после него уже не пройдёт
+        r.incr(GENERATION_KEY)
+        r.delete(*keys)
+    except Exception as e:  # noqa: BLE001
+        logger.warning(f"Failed to invalidate lessons view cache: {e}")
+
+
+async def ainvalidate(r, student_ids=(), admin: bool = True) -> None:
+    """Асинхронный ``invalidate`` (клиент ``redis.asyncio``)."""
+    keys = _keys(student_ids, admin)
+    if not keys:
+        return
+    try:
+        await r.incr(GENERATION_KEY)
+        await r.delete(*keys)
+    except Exception as e:  # noqa: BLE001
+        logger.warning(f"Failed to invalidate lessons view cache: {e}")
+
+
+async def aget(r, key: str) -> str | None:
+    """Значение из кэша или None (в том числе если Redis недоступен)."""
+    try:
+        raw = await r.get(key)
+    except Exception as e:  # noqa: BLE001
+        logger.warning(f"Lessons view cache unavailable: {e}")
+        return None
+    return raw.decode() if isinstance(raw, bytes) else raw
+
+
+async def ageneration(r) -> str | None:
+    """Текущее поколение (вызывать до чтения из БД); None — Redis недоступен."""
+    try:
+        raw = await r.get(GENERATION_KEY)
+    except Exception as e:  # noqa: BLE001
+        logger.warning(f"Lessons view cache unavailable: {e}")
+        return None
+    return (raw.decode() if isinstance(raw, bytes) else str(raw)) if raw is not None else "0"
+
+
+async def astore(r, key: str, value, ttl: int, generation: str | None) -> None:
+    """Сохранить значение, если с ``generation`` кэш не сбрасывался."""
+    if generation is None:
+        return
+    try:
+        await r.eval(_STORE_SCRIPT, 2, GENERATION_KEY, key, generation, value, ttl)
+    except Exception as e:  # noqa: BLE001
+        logger.warning(f"Failed to store lessons view cache: {e}")
+
+
+def ttl_seconds(lessons) -> int:
+    """Сколько хранить список: до начала первого урока, но не дольше настройки."""
+    ttl = settings.LESSONS_VIEW_TTL_SECONDS
+    if lessons:
+        ttl = min(ttl, int((lessons[0].start - datetime.now(timezone.utc)).total_seconds()))
+    return max(ttl, 1)
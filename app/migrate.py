@@ -0,0 +1,48 @@
+"""Миграции схемы БД (Alembic, ``app/migrations``).
+
+Вызывается при старте worker и бота вместо ``create_all``: все сервисы
+стартуют одновременно, поэтому миграции выполняются в одной транзакции под
+``pg_advisory_xact_lock`` — второй процесс дождётся первого и увидит, что
+применять уже нечего.
+
+База, созданная ``create_all`` до появления миграций (таблицы есть, а
+``alembic_version`` нет), помечается базовой ревизией ``0001`` и
+доводится до последней обычным образом.
+
+Запуск вручную: ``python -m app.migrate`` (или ``alembic upgrade head``).
+"""
+from pathlib import Path
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect, text
+
+from .db import engine
+
+BASELINE_REVISION = "0001"
+# Ключ advisory lock для миграций (любое постоянное число)
+_LOCK_KEY = 7_160_921_016
+
+_SCRIPT_LOCATION = Path(__file__).with_name("migrations")
+
+
+def _config(connection) -> Config:
+    cfg = Config()
+    cfg.set_main_option("script_location", str(_SCRIPT_LOCATION))
+    cfg.attributes["connection"] = connection
+    return cfg
+
+
+def upgrade(bind=engine, revision: str = "head") -> None:
+    """Применить миграции до ``revision`` (по умолчанию — последней)."""
+    with bind.begin() as connection:
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _LOCK_KEY})
+        cfg = _config(connection)
+        inspector = inspect(connection)
+        if not inspector.has_table("alembic_version") and inspector.has_table("students"):
+            command.stamp(cfg, BASELINE_REVISION)
+        command.upgrade(cfg, revision)
+
+
+if __name__ == "__main__":
+    upgrade()
@@ -0,0 +1,47 @@
+"""Окружение Alembic.
+
+Миграции запускает ``app.migrate.upgrade`` (при старте worker и бота) на
+своём соединении под advisory lock; команда ``alembic`` из корня репозитория
+(``alembic.ini``) подключается к ``DATABASE_URL`` сама.
+"""
+from alembic import context
+
+from app import models  # noqa: F401  регистрирует таблицы в Base.metadata
+from app.config import settings
+from app.db import Base, engine
+
+config = context.config
+target_metadata = Base.metadata
+
+
+def _run(connection) -> None:
+    context.configure(connection=connection, target_metadata=target_metadata, compare_type=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_offline() -> None:
+    """SQL-скрипт без подключения к базе (``alembic upgrade head --sql``)."""
+    context.configure(
+        url=settings.DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        _run(connection)
+        return
+    with engine.connect() as connection:
+        _run(connection)
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
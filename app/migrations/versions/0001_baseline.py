@@ -0,0 +1,50 @@
+"""Baseline: schema created by create_all before migrations were introduced
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'students',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('summary', sa.String(), nullable=False, unique=True),
+        sa.Column('is_active', sa.Boolean()),
+        sa.Column('paid_lessons_count', sa.Integer()),
+    )
+    op.create_index('ix_students_id', 'students', ['id'])
+    op.create_table(
+        'lessons',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('event_uid', sa.String()),
+        sa.Column('summary', sa.String()),
+        sa.Column('start', sa.DateTime()),
+        sa.Column('end', sa.DateTime()),
+        sa.Column('is_paid', sa.Boolean()),
+        sa.Column('student_id', sa.Integer(), sa.ForeignKey('students.id')),
+    )
+    op.create_index('ix_lessons_id', 'lessons', ['id'])
+    op.create_index('ix_lessons_event_uid', 'lessons', ['event_uid'], unique=True)
+    op.create_table(
+        'tg_links',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('tg_user_id', sa.String()),
+        sa.Column('student_id', sa.Integer(), sa.ForeignKey('students.id')),
+    )
+    op.create_index('ix_tg_links_tg_user_id', 'tg_links', ['tg_user_id'])
+
+
+def downgrade() -> None:
+    op.drop_table('tg_links')
+    op.drop_table('lessons')
+    op.drop_table('students')
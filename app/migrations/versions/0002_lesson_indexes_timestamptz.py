@@ -0,0 +1,68 @@
+"""Indexes for hot queries, timestamptz lesson times, tg_links unique constraint
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Время уроков хранилось как UTC без зоны
+    for column in ('start', 'end'):
+        op.alter_column(
+            'lessons',
+            column,
+            type_=sa.DateTime(timezone=True),
+            existing_type=sa.DateTime(),
+            postgresql_using=f'"{column}" AT TIME ZONE \'UTC\'',
+        )
+
+    op.create_index('ix_lessons_student_id_start', 'lessons', ['student_id', 'start'])
+    op.create_index('ix_lessons_start', 'lessons', ['start'])
+    op.create_index(
+        'ix_lessons_unpaid_end',
+        'lessons',
+        ['end'],
+        postgresql_where=sa.text('is_paid IS NOT true'),
+    )
+    op.create_index('ix_tg_links_student_id', 'tg_links', ['student_id'])
+
+    # UniqueConstraint был объявлен в теле класса и не создавался: убираем дубли
+    op.execute(
+        'DELETE FROM tg_links a USING tg_links b '
+        'WHERE a.id > b.id AND a.tg_user_id = b.tg_user_id AND a.student_id = b.student_id'
+    )
+    op.create_unique_constraint('uix_tg_student', 'tg_links', ['tg_user_id', 'student_id'])
+
+    # Индексы постраничного списка учеников могли уже создать create_all
+    op.create_index('ix_students_summary_id', 'students', ['summary', 'id'], if_not_exists=True)
+    op.execute(
+        'CREATE INDEX IF NOT EXISTS ix_students_summary_lower_prefix '
+        'ON students (lower(summary) text_pattern_ops)'
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_students_summary_lower_prefix', table_name='students')
+    op.drop_index('ix_students_summary_id', table_name='students')
+    op.drop_constraint('uix_tg_student', 'tg_links', type_='unique')
+    op.drop_index('ix_tg_links_student_id', table_name='tg_links')
+    op.drop_index('ix_lessons_unpaid_end', table_name='lessons')
+    op.drop_index('ix_lessons_start', table_name='lessons')
+    op.drop_index('ix_lessons_student_id_start', table_name='lessons')
+    for column in ('start', 'end'):
+        op.alter_column(
+            'lessons',
+            column,
+            type_=sa.DateTime(),
+            existing_type=sa.DateTime(timezone=True),
+            postgresql_using=f'"{column}" AT TIME ZONE \'UTC\'',
+        )
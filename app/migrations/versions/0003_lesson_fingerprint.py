@@ -0,0 +1,23 @@
+"""Lesson content fingerprint for change detection
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Существующие уроки получат отпечаток при первой синхронизации worker
+    op.add_column('lessons', sa.Column('fingerprint', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('lessons', 'fingerprint')
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, ForeignKey, Index, UniqueConstraint, func
 from sqlalchemy.orm import relationship
 from .db import Base
 
@@ -9,21 +9,48 @@ class Student(Base):
     is_active = Column(Boolean, default=True)  # True - active, False - inactive
     paid_lessons_count = Column(Integer, default=0)
     lessons = relationship('Lesson', back_populates='student')
+    tg_links = relationship('TgLink', back_populates='student')
+    __table_args__ = (
+        # Постраничный вывод (keyset по summary, id)
+        Index('ix_students_summary_id', 'summary', 'id'),
+        # Поиск по началу имени без учёта регистра: lower(summary) LIKE 'abc%'
+        Index(
+            'ix_students_summary_lower_prefix',
+            func.lower(summary).label('summary_lower'),
+            postgresql_ops={'summary_lower': 'text_pattern_ops'},
+        ),
+    )
 
 class Lesson(Base):
     __tablename__ = 'lessons'
     id = Column(Integer, primary_key=True, index=True)
     event_uid = Column(String, unique=True, index=True)
     summary = Column(String)
-    start = Column(DateTime)
-    end = Column(DateTime)
+    # timestamptz: момент времени, сравнивается с aware datetime без приведений
+    start = Column(DateTime(timezone=True))
+    end = Column(DateTime(timezone=True))
     is_paid = Column(Boolean, default=False)
     student_id = Column(Integer, ForeignKey('students.id'))
     student = relationship('Student', back_populates='lessons')
+    # sha256 от UID, времени в UTC, названия и ученика (crud.lesson_fingerprint)
+    fingerprint = Column(String(64))
+    __table_args__ = (
+        # Предстоящие уроки ученика: student_id = ? AND start >= ? ORDER BY start
+        Index('ix_lessons_student_id_start', 'student_id', 'start'),
+        # Все предстоящие уроки: start >= ? ORDER BY start
+        Index('ix_lessons_start', 'start'),
+        # Списание за завершённые уроки: неоплаченные по времени окончания
+        Index('ix_lessons_unpaid_end', 'end', postgresql_where=is_paid.isnot(True)),
+    )
 
 class TgLink(Base):
     __tablename__ = 'tg_links'
     id = Column(Integer, primary_key=True)
     tg_user_id = Column(String, index=True)
     student_id = Column(Integer, ForeignKey('students.id'))
-    UniqueConstraint('tg_user_id', 'student_id', name='uix_tg_student')
+    student = relationship('Student', back_populates='tg_links')
+    __table_args__ = (
+        UniqueConstraint('tg_user_id', 'student_id', name='uix_tg_student'),
+        # Получатели напоминаний: tg_links по student_id
+        Index('ix_tg_links_student_id', 'student_id'),
+    )
@@ -0,0 +1,40 @@
+"""Доставка уведомлений из Celery в бота через Redis Streams.
+
+Задачи Celery не ходят в бота по HTTP, а добавляют запись (``XADD``) в
+поток ``notify_stream``. Бот читает поток пачками через группу
+потребителей ``bot`` (``XREADGROUP``), отправляет сообщения и
+подтверждает записи (``XACK``). Записи, не подтверждённые за
+``NOTIFY_STREAM_CLAIM_IDLE_SECONDS`` (бот упал посреди обработки),
+забирает другой или перезапущенный потребитель. Пока бот недоступен,
+записи просто копятся в потоке — без ошибок и повторов на стороне Celery.
+
+Формат записи:
+- ``{"type": "lessons", "lesson_ids": "1,2,3"}`` — напоминания об уроках;
+- ``{"type": "admin", "message": "<текст>"}`` — сообщение администратору.
+"""
+
+NOTIFY_STREAM_KEY = "notify_stream"
+NOTIFY_STREAM_GROUP = "bot"
+
+
+def publish_lessons(r, lesson_ids, maxlen: int | None = None) -> str:
+    """Поставить напоминания об уроках; вернуть id записи."""
+    fields = {"type": "lessons", "lesson_ids": ",".join(str(int(i)) for i in lesson_ids)}
+    return r.xadd(NOTIFY_STREAM_KEY, fields, maxlen=maxlen, approximate=True)
+
+
+def publish_admin(r, message: str, maxlen: int | None = None) -> str:
+    """Поставить сообщение администратору; вернуть id записи."""
+    return r.xadd(NOTIFY_STREAM_KEY, {"type": "admin", "message": message}, maxlen=maxlen, approximate=True)
+
+
+def decode_fields(fields: dict) -> dict[str, str]:
+    """Поля записи из Redis (bytes) -> str."""
+    return {
+        (k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+        for k, v in fields.items()
+    }
+
+
+def parse_lesson_ids(value: str) -> list[int]:
+    return [int(part) for part in value.split(",") if part]
@@ -0,0 +1,129 @@
+"""Проверка планов горячих запросов через EXPLAIN.
+
+На маленьких таблицах Postgres законно выбирает Seq Scan, поэтому проверка
+запускается с ``enable_seqscan = off``: если подходящий индекс есть,
+планировщик возьмёт его; если индекс пропал (или запрос перестал под него
+подходить), в плане останется Seq Scan по таблице — это и есть регрессия.
+
+Пример::
+
+    python -m app.plan_check          # код возврата 1, если есть Seq Scan
+
+    with engine.connect() as conn:
+        check_plans(conn)             # PlanCheckFailed со списком запросов
+"""
+from __future__ import annotations
+
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select, text
+
+from . import models
+
+
+class PlanCheckFailed(AssertionError):
+    """Горячий запрос выполняется полным просмотром таблицы."""
+
+
+def _hot_queries():
+    """(название, запрос, таблица, которую запрос должен читать по индексу)."""
+    now = datetime.now(timezone.utc)
+    Lesson, TgLink, Student = models.Lesson, models.TgLink, models.Student
+    return [
+        (
+            "upcoming lessons",
+            select(Lesson).where(Lesson.start >= now).order_by(Lesson.start).limit(20),
+            "lessons",
+        ),
+        (
+            "lessons for student",
+            select(Lesson)
+            .where(Lesson.student_id == 1, Lesson.start >= now)
+            .order_by(Lesson.start)
+            .limit(10),
+            "lessons",
+        ),
+        (
+            "links for student",
+            select(TgLink).where(TgLink.student_id == 1),
+            "tg_links",
+        ),
+        (
+            "student by tg user",
+            select(Student).join(TgLink, TgLink.student_id == Student.id).where(TgLink.tg_user_id == "1"),
+            "tg_links",
+        ),
+        (
+            "lessons to settle",
+            select(Lesson.id)
+            .where(Lesson.is_paid.is_not(True), Lesson.end <= now, Lesson.end > now - timedelta(hours=48))
+            .order_by(Lesson.end)
+            .limit(500),
+            "lessons",
+        ),
+        (
+            "overdue unpaid lessons",
+            select(Lesson.summary)
+            .where(Lesson.is_paid.is_not(True), Lesson.end <= now - timedelta(hours=48))
+            .order_by(Lesson.end.desc())
+            .limit(10),
+            "lessons",
+        ),
+        (
+            "student prefix search",
+            select(Student)
+            .where(func.lower(Student.summary).like("ab%", escape="\\"))
+            .order_by(Student.summary, Student.id)
+            .limit(11),
+            "students",
+        ),
+    ]
+
+
+def _scans(plan: dict):
+    """Все узлы плана: (тип узла, таблица)."""
+    yield plan.get("Node Type"), plan.get("Relation Name")
+    for child in plan.get("Plans", ()):
+        yield from _scans(child)
+
+
+def explain(connection, statement) -> dict:
+    """План запроса (EXPLAIN FORMAT JSON) — корневой узел."""
+    sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+    # Пустые параметры: драйвер сам превратит экранированные "%%" обратно в "%"
+    raw = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}", {}).scalar_one()
+    data = json.loads(raw) if isinstance(raw, str) else raw
+    return data[0]["Plan"]
+
+
+def check_plans(connection) -> dict[str, dict]:
+    """Проверить, что горячие запросы читают свои таблицы по индексу.
+
+    Returns: {название: план}. Бросает ``PlanCheckFailed``, если где-то Seq Scan.
+    """
+    plans = {}
+    failures = []
+    with connection.begin():
+        connection.execute(text("SET LOCAL enable_seqscan = off"))
+        for name, statement, table in _hot_queries():
+            plan = explain(connection, statement)
+            plans[name] = plan
+            if ("Seq Scan", table) in set(_scans(plan)):
+                failures.append(f"{name}: Seq Scan on {table}")
+    if failures:
+        raise PlanCheckFailed("Hot queries without index:\n" + "\n".join(failures))
+    return plans
+
+
+if __name__ == "__main__":
+    from .db import engine
+
+    with engine.connect() as conn:
+        try:
+            check_plans(conn)
+        except PlanCheckFailed as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+    print("All hot queries are index-backed")
@@ -0,0 +1,53 @@
+"""Подсчёт SQL-запросов — для тестов и бенчмарков обработчиков.
+
+Пример::
+
+    with count_queries(engine, max_queries=1) as counter:
+        lessons = await async_crud.get_lessons_notification(db, lesson_ids)
+    print(counter.count, counter.statements)
+
+Работает и с обычным ``Engine``, и с ``AsyncEngine`` (слушатель вешается
+на его ``sync_engine``). При превышении ``max_queries`` на выходе из блока
+бросается ``QueryCountExceeded`` со списком выполненных запросов.
+"""
+from __future__ import annotations
+
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+
+
+class QueryCountExceeded(AssertionError):
+    """Блок выполнил больше запросов, чем разрешено."""
+
+
+@dataclass
+class QueryCounter:
+    statements: list[str] = field(default_factory=list)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+@contextmanager
+def count_queries(engine, max_queries: int | None = None):
+    """Считать запросы к ``engine`` внутри блока; опционально проверить лимит."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    counter = QueryCounter()
+
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter.statements.append(statement)
+
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", _before_cursor_execute)
+
+    if max_queries is not None and counter.count > max_queries:
+        statements = "\n\n".join(counter.statements)
+        raise QueryCountExceeded(
+            f"Expected at most {max_queries} queries, got {counter.count}:\n\n{statements}"
+        )
@@ -0,0 +1,168 @@
+"""Кэш страниц учеников для клавиатур бота (в памяти процесса и в Redis)."""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = "students:gen"
+_SNAPSHOT_KEY = "students:{key}:{generation}"
+# Сколько разных ключей (страниц, префиксов поиска) держать в памяти процесса
+_LOCAL_MAXSIZE = 256
+
+
+@dataclass(frozen=True)
+class StudentRow:
+    id: int
+    summary: str
+    is_active: bool
+    paid_lessons_count: int
+
+
+def rows_from_models(students) -> list[StudentRow]:
+    return [
+        StudentRow(
+            id=s.id,
+            summary=s.summary,
+            is_active=bool(s.is_active),
+            paid_lessons_count=s.paid_lessons_count or 0,
+        )
+        for s in students
+    ]
+
+
+class _LocalCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> (generation, expires_at, value)
+        self._entries: OrderedDict[str, tuple[int | None, float, object]] = OrderedDict()
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def lookup(self, key: str, generation: int | None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation and time.monotonic() < entry[1]:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+        return None
+
+    def store(self, key: str, generation: int | None, value) -> None:
+        with self._lock:
+            self._entries[key] = (generation, time.monotonic() + settings.STUDENT_CACHE_TTL_SECONDS, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > _LOCAL_MAXSIZE:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def count(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def stats(self) -> dict:
+        total = self.hits + self.redis_hits + self.misses
+        return {
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.redis_hits) / total, 3) if total else 0.0,
+        }
+
+
+_local = _LocalCache()
+_redis = None
+_aredis = None
+
+
+def _sync_redis():
+    global _redis
+    if _redis is None:
+        import redis
+
+        _redis = redis.Redis.from_url(settings.REDIS_URL)
+    return _redis
+
+
+def _async_redis():
+    global _aredis
+    if _aredis is None:
+        from redis.asyncio import Redis
+
+        _aredis = Redis.from_url(settings.REDIS_URL)
+    return _aredis
+
+
+def _snapshot_key(key: str, generation: int) -> str:
+    return _SNAPSHOT_KEY.format(key=key, generation=generation)
+
+
+def stats() -> dict:
+    """Счётчики попаданий этого процесса."""
+    return _local.stats()
+
+
+def invalidate() -> None:
+    """Сбросить кэш после изменения учеников (вызывать после commit)."""
+    _local.clear()
+    if settings.STUDENT_CACHE_REDIS:
+        try:
+            _sync_redis().incr(GENERATION_KEY)
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"Failed to invalidate student cache in Redis: {e}")
+
+
+async def aget(key: str, load, encode, decode):
+    """Значение ``key`` из кэша; при промахе — ``await load()``."""
+    if not settings.STUDENT_CACHE_REDIS:
+        value = _local.lookup(key, None)
+        if value is None:
+            _local.count("misses")
+            value = await load()
+            _local.store(key, None, value)
+        return value
+    r = _async_redis()
+    try:
+        generation = int(await r.get(GENERATION_KEY) or 0)
+        value = _local.lookup(key, generation)
+        if value is not None:
+            return value
+        raw = await r.get(_snapshot_key(key, generation))
+    except Exception as e:  # noqa: BLE001
+        logger.warning(f"Student cache unavailable, reading from database: {e}")
+        _local.count("misses")
+        return await load()
+    if raw is not None:
+        _local.count("redis_hits")
+        value = decode(raw)
+        _local.store(key, generation, value)
+        return value
+    _local.count("misses")
+    value = await load()
+    # Если ученики изменились во время чтения, поколение уже другое и значение не будет использовано
+    _local.store(key, generation, value)
+    try:
+        await r.set(_snapshot_key(key, generation), encode(value), ex=settings.STUDENT_CACHE_TTL_SECONDS)
+    except Exception as e:  # noqa: BLE001
+        logger.warning(f"Failed to store students in Redis: {e}")
+    return value
+
+
+async def ainvalidate() -> None:
+    """Асинхронный ``invalidate``."""
+    _local.clear()
+    if settings.STUDENT_CACHE_REDIS:
+        try:
+            await _async_redis().incr(GENERATION_KEY)
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"Failed to invalidate student cache in Redis: {e}")
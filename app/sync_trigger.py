@@ -0,0 +1,17 @@
+"""Внеочередная синхронизация календарей по запросу.
+
+Бот (или любой другой сервис) публикует сообщение в канал Redis
+``worker:sync_now``; worker подписан на канал и запускает опрос после
+короткой паузы, объединяя серию запросов в одну синхронизацию. Тело
+сообщения — имя календаря (``email/calendar``) или пустая строка для всех.
+"""
+
+SYNC_NOW_CHANNEL = "worker:sync_now"
+
+
+def request_sync(r, calendar: str | None = None) -> int:
+    """Попросить worker синхронизироваться; вернуть число подписчиков канала.
+
+    С клиентом ``redis.asyncio`` результат нужно дождаться через ``await``.
+    """
+    return r.publish(SYNC_NOW_CHANNEL, calendar or "")
@@ -0,0 +1,22 @@
+"""Время уроков в сообщениях.
+
+В базе время хранится как timestamptz (момент в UTC), ученикам и
+администратору показывается локальное время ``TIMEZONE``.
+"""
+from datetime import datetime, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+from .config import settings
+
+
+@lru_cache(maxsize=1)
+def local_tz() -> ZoneInfo:
+    return ZoneInfo(settings.TIMEZONE)
+
+
+def format_local(value: datetime, fmt: str = "%d.%m.%Y %H:%M") -> str:
+    """Отформатировать момент времени в часовом поясе ``TIMEZONE``."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(local_tz()).strftime(fmt)
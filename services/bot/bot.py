@@ -3,12 +3,34 @@
 """
 import logging
 from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.redis import RedisStorage
+from redis.asyncio import Redis
 from app.config import settings
 from app.logging_config import setup_root_logging
+from sender import SendEngine
 
 # Настройка логирования с ротацией по дням
 logger = setup_root_logging('bot', log_level=logging.INFO)
 
-# Создание экземпляров бота и диспетчера
+# Общий асинхронный клиент Redis для бота
+redis_client = Redis.from_url(settings.REDIS_URL)
+
+# Создание экземпляров бота и диспетчера; состояния диалогов (FSM) — в Redis,
+# общие для всех процессов бота
 bot = Bot(token=settings.TG_BOT_TOKEN)
-dp = Dispatcher()
\ No newline at end of file
+dp = Dispatcher(
+    storage=RedisStorage(
+        redis_client,
+        state_ttl=settings.BOT_FSM_TTL_SECONDS,
+        data_ttl=settings.BOT_FSM_TTL_SECONDS,
+    )
+)
+
+# Отправка уведомлений с лимитами Telegram (общий и на чат)
+sender = SendEngine(
+    bot,
+    concurrency=settings.BOT_SEND_CONCURRENCY,
+    global_rate=settings.BOT_SEND_GLOBAL_RATE,
+    chat_rate=settings.BOT_SEND_CHAT_RATE,
+    max_retries=settings.BOT_SEND_MAX_RETRIES,
+)
@@ -3,48 +3,35 @@
 """
 from __future__ import annotations
 
-from collections.abc import Iterable
 from typing import Final
 
 from aiogram import F, types
 from aiogram.exceptions import TelegramForbiddenError
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from app import crud
-from app.db import SessionLocal
-from bot import bot, dp, logger
+from app import async_crud, lessons_view_cache
+from app.db import AsyncSessionLocal
+from app.sync_trigger import request_sync
+from app.timeutil import format_local
+from bot import bot, dp, logger, redis_client
 from filters import IsAdmin, IsAdminCallback
-
-# Временное хранилище для установки точного значения оплаченных занятий
-_PENDING_PAYMENT_SET: dict[int, int] = {}
+from keyboards import (
+    KIND_LIST,
+    KIND_PAYMENT,
+    KIND_TOGGLE,
+    PAGE_SIZE,
+    build_students_page_keyboard,
+    format_students_list,
+    load_students_page,
+)
+from states import PaymentStates
 
 # Ограничение на число уроков, показываемых администратору
 _LESSONS_LIMIT: Final[int] = 20
 
 
-def _format_students_list(students: Iterable, include_paid: bool = True) -> str:
-    """Сформировать человекочитаемый список учеников."""
-    lines: list[str] = []
-    for student in students:
-        status = "✅ Активен" if student.is_active else "❌ Неактивен"
-        paid = f"\n  Оплаченных занятий: {student.paid_lessons_count}" if include_paid else ""
-        lines.append(f"• {student.summary}\n  Статус: {status}{paid}")
-    return "\n\n".join(lines)
-
-
-def _build_students_keyboard(students, callback_template: str) -> InlineKeyboardBuilder:
-    """Построить клавиатуру с учениками и произвольным шаблоном callback."""
-    kb = InlineKeyboardBuilder()
-    for student in students:
-        status_display = "✅ Активен" if student.is_active else "❌ Неактивен"
-        kb.button(
-            text=f"{student.summary} ({status_display})",
-            callback_data=f"{callback_template}:{student.id}",
-        )
-    kb.adjust(1)
-    return kb
-
-
 def _build_payment_keyboard(student_id: int) -> InlineKeyboardBuilder:
     """Клавиатура для управления количеством оплаченных занятий."""
     kb = InlineKeyboardBuilder()
@@ -69,9 +56,11 @@ async def cmd_start_admin(message: types.Message) -> None:
         "/start — это сообщение\n"
         "/help — справка по командам\n"
         "/students — список всех учеников\n"
+        "/find — поиск ученика по началу имени\n"
         "/inactive — управление активностью учеников\n"
         "/payment — управление оплаченными занятиями\n"
         "/lessons — предстоящие уроки\n"
+        "/sync — синхронизировать календарь сейчас\n"
         "\nВы также получаете уведомления о новых пользователях для привязки к ученикам."
     )
     await message.answer(help_text)
@@ -83,10 +72,12 @@ async def cmd_help_admin(message: types.Message) -> None:
     help_text = (
         "📖 Справка по командам администратора:\n\n"
         "/start — приветствие и список команд\n"
-        "/students — показать всех учеников с их статусами и количеством оплаченных занятий\n"
+        "/students — показать всех учеников с их статусами и количеством оплаченных занятий (по страницам)\n"
+        "/find <начало имени> — найти учеников и перейти к их оплаченным занятиям\n"
         "/inactive — включить/выключить активность ученика\n"
         "/payment — добавить/убрать оплаченные занятия ученикам\n"
         "/lessons — показать ближайшие уроки (до 20)\n"
+        "/sync — не дожидаясь опроса, синхронизировать календарь (повторные запросы в течение нескольких секунд объединяются)\n"
         "\n🔔 Автоматические уведомления:\n"
         "• При подключении нового пользователя вы получите сообщение с кнопками для привязки к ученику\n"
         "• Callback-кнопки для привязки пользователей работают только для вас"
@@ -96,62 +87,125 @@ async def cmd_help_admin(message: types.Message) -> None:
 
 @dp.message(F.text == "/students", IsAdmin)
 async def cmd_students(message: types.Message) -> None:
-    """Показать список всех учеников."""
-    db = SessionLocal()
-    try:
-        students = crud.list_students(db)
-        if not students:
-            await message.answer("Нет учеников в базе.")
-            return
-        response = "📚 Список всех учеников:\n\n" + _format_students_list(students)
-        await message.answer(response)
-    finally:
-        db.close()
+    """Показать список учеников (постранично)."""
+    async with AsyncSessionLocal() as db:
+        page = await load_students_page(db)
+    if not page.students:
+        await message.answer("Нет учеников в базе.")
+        return
+    kb = build_students_page_keyboard(page, KIND_LIST)
+    await message.answer(
+        "📚 Список учеников:\n\n" + format_students_list(page.students),
+        reply_markup=kb.as_markup(),
+    )
 
 
 @dp.message(F.text == "/inactive", IsAdmin)
 async def cmd_inactive(message: types.Message) -> None:
     """Показать клавиатуру для управления активностью учеников."""
-    db = SessionLocal()
-    try:
-        students = crud.list_students(db)
-        if not students:
-            await message.answer("Нет учеников в базе.")
-            return
-        kb = _build_students_keyboard(students, "toggle_active")
-        await message.answer(
-            "Выберите ученика для изменения статуса активности:",
-            reply_markup=kb.as_markup(),
-        )
-    finally:
-        db.close()
+    async with AsyncSessionLocal() as db:
+        page = await load_students_page(db)
+    if not page.students:
+        await message.answer("Нет учеников в базе.")
+        return
+    kb = build_students_page_keyboard(page, KIND_TOGGLE)
+    await message.answer(
+        "Выберите ученика для изменения статуса активности:",
+        reply_markup=kb.as_markup(),
+    )
 
 
 @dp.message(F.text == "/lessons", IsAdmin)
 async def cmd_lessons_admin(message: types.Message) -> None:
-    """Показать список предстоящих уроков."""
-    db = SessionLocal()
-    try:
-        lessons = crud.get_upcoming_lessons(db, limit=_LESSONS_LIMIT)
-        if not lessons:
-            await message.answer("📚 На данный момент нет запланированных уроков.")
-            return
+    """Показать список предстоящих уроков (ответ кэшируется в Redis)."""
+    cached = await lessons_view_cache.aget(redis_client, lessons_view_cache.ADMIN_KEY)
+    if cached is not None:
+        await message.answer(cached)
+        return
+
+    generation = await lessons_view_cache.ageneration(redis_client)
+    async with AsyncSessionLocal() as db:
+        lessons = await async_crud.get_upcoming_lessons(db, limit=_LESSONS_LIMIT)
+    if not lessons:
+        await message.answer("📚 На данный момент нет запланированных уроков.")
+        return
+
+    response_lines = [
+        f"📚 Все предстоящие уроки ({len(lessons)}):",
+        "",
+    ]
+    for idx, lesson in enumerate(lessons, 1):
+        start_str = format_local(lesson.start)
+        paid_mark = "✅" if lesson.is_paid else "⏳"
+        student_name = lesson.student.summary if lesson.student else "Неизвестный"
+        response_lines.append(f"{idx}. {paid_mark} {lesson.summary}")
+        response_lines.append(f"   👤 {student_name}")
+        response_lines.append(f"   📅 {start_str}")
+        response_lines.append(f"   🆔 ID: {lesson.id}\n")
+    response = "\n".join(response_lines).strip()
+    await lessons_view_cache.astore(
+        redis_client, lessons_view_cache.ADMIN_KEY, response, lessons_view_cache.ttl_seconds(lessons), generation
+    )
+    await message.answer(response)
+
+
+@dp.message(F.text == "/sync", IsAdmin)
+async def cmd_sync(message: types.Message) -> None:
+    """Запросить у worker внеочередную синхронизацию календарей."""
+    listeners = await request_sync(redis_client)
+    if not listeners:
+        await message.answer("⚠️ Worker сейчас не слушает запросы синхронизации. Попробуйте позже.")
+        return
+    await message.answer("🔄 Синхронизация календаря запрошена. Изменения появятся в течение минуты.")
+
+
+@dp.callback_query(F.data.startswith("stpage:"), IsAdminCallback)
+async def process_students_page(callback_query: types.CallbackQuery) -> None:
+    """Перелистнуть страницу любого списка учеников."""
+    data = callback_query.data.split(":")
+    if (
+        len(data) not in (4, 5)
+        or data[2] not in ("next", "prev")
+        or not data[3].isdigit()
+        or (len(data) == 5 and not data[4].isdigit())
+    ):
+        await callback_query.answer("Неверные данные")
+        return
+    kind, direction, cursor_id = data[1], data[2], int(data[3])
+    tg_user_id = data[4] if len(data) == 5 else None
+
+    async with AsyncSessionLocal() as db:
+        page = await load_students_page(db, cursor_id, direction)
+    kb = build_students_page_keyboard(page, kind, tg_user_id)
+    if kind == KIND_LIST:
+        await callback_query.message.edit_text(
+            "📚 Список учеников:\n\n" + format_students_list(page.students),
+            reply_markup=kb.as_markup(),
+        )
+    else:
+        await callback_query.message.edit_reply_markup(reply_markup=kb.as_markup())
+    await callback_query.answer()
+
 
-        response_lines = [
-            f"📚 Все предстоящие уроки ({len(lessons)}):",
-            "",
-        ]
-        for idx, lesson in enumerate(lessons, 1):
-            start_str = lesson.start.strftime("%d.%m.%Y %H:%M")
-            paid_mark = "✅" if lesson.is_paid else "⏳"
-            student_name = lesson.student.summary if lesson.student else "Неизвестный"
-            response_lines.append(f"{idx}. {paid_mark} {lesson.summary}")
-            response_lines.append(f"   👤 {student_name}")
-            response_lines.append(f"   📅 {start_str}")
-            response_lines.append(f"   🆔 ID: {lesson.id}\n")
-        await message.answer("\n".join(response_lines).strip())
-    finally:
-        db.close()
+@dp.message(Command("find"), IsAdmin)
+async def cmd_find(message: types.Message, command: CommandObject) -> None:
+    """Найти учеников по началу имени: /find <начало имени>."""
+    prefix = (command.args or "").strip()
+    if not prefix:
+        await message.answer("Укажите начало имени: /find Иван")
+        return
+    async with AsyncSessionLocal() as db:
+        page = await async_crud.list_students_page(db, PAGE_SIZE, prefix=prefix)
+    if not page.students:
+        await message.answer(f"Ученики, начинающиеся с «{prefix}», не найдены.")
+        return
+    text = f"🔎 Ученики на «{prefix}»:\n\n" + format_students_list(page.students)
+    if page.has_next:
+        text += f"\n\nПоказаны первые {PAGE_SIZE}, уточните запрос."
+    kb = build_students_page_keyboard(
+        async_crud.StudentPage(page.students, has_prev=False, has_next=False), KIND_PAYMENT
+    )
+    await message.answer(text, reply_markup=kb.as_markup())
 
 
 @dp.callback_query(F.data.startswith("map:"), IsAdminCallback)
@@ -164,17 +218,13 @@ async def process_map(callback_query: types.CallbackQuery) -> None:
 
     tg_user_id = data[1]
     student_id = int(data[2])
-    db = SessionLocal()
-    try:
-        student = crud.get_student_by_id(db, student_id)
+    async with AsyncSessionLocal() as db:
+        student = await async_crud.get_student_by_id(db, student_id)
         if not student:
             await callback_query.answer("Ученик не найден")
             return
         student_summary = student.summary
-        crud.create_tg_link(db, tg_user_id, student_id)
-        db.commit()
-    finally:
-        db.close()
+        await async_crud.create_tg_link(db, tg_user_id, student_id)
 
     await callback_query.message.edit_text(
         f"Пользователь привязан к ученику: {student_summary}", reply_markup=None
@@ -191,24 +241,23 @@ async def process_map(callback_query: types.CallbackQuery) -> None:
 async def process_toggle_active(callback_query: types.CallbackQuery) -> None:
     """Переключить активность ученика."""
     data = callback_query.data.split(":")
-    if len(data) != 2:
+    if len(data) not in (2, 3):
         await callback_query.answer("Неверные данные")
         return
 
     student_id = int(data[1])
-    db = SessionLocal()
-    try:
-        student = crud.toggle_student_active_status(db, student_id)
+    # Первый ученик текущей страницы — чтобы остаться на ней после переключения
+    page_start = int(data[2]) if len(data) == 3 and data[2] != "0" else None
+    async with AsyncSessionLocal() as db:
+        student = await async_crud.toggle_student_active_status(db, student_id)
         if not student:
             await callback_query.answer("Ошибка: ученик не найден")
             return
         student_summary = student.summary
         status_text = "активен" if student.is_active else "неактивен"
-        students = crud.list_students(db)
-        kb = _build_students_keyboard(students, "toggle_active")
-    finally:
-        db.close()
+        page = await load_students_page(db, page_start, "from")
 
+    kb = build_students_page_keyboard(page, KIND_TOGGLE)
     await callback_query.message.edit_text(
         "Выберите ученика для изменения статуса активности:",
         reply_markup=kb.as_markup(),
@@ -219,25 +268,16 @@ async def process_toggle_active(callback_query: types.CallbackQuery) -> None:
 @dp.message(F.text == "/payment", IsAdmin)
 async def cmd_payment(message: types.Message) -> None:
     """Команда /payment — управление оплаченными занятиями."""
-    db = SessionLocal()
-    try:
-        students = crud.list_students(db)
-        if not students:
-            await message.answer("Нет учеников в базе.")
-            return
-        kb = InlineKeyboardBuilder()
-        for student in students:
-            kb.button(
-                text=f"{student.summary} ({student.paid_lessons_count} оплачено)",
-                callback_data=f"payment_select:{student.id}",
-            )
-        kb.adjust(1)
-        await message.answer(
-            "💰 Выберите ученика для управления оплаченными занятиями:",
-            reply_markup=kb.as_markup(),
-        )
-    finally:
-        db.close()
+    async with AsyncSessionLocal() as db:
+        page = await load_students_page(db)
+    if not page.students:
+        await message.answer("Нет учеников в базе.")
+        return
+    kb = build_students_page_keyboard(page, KIND_PAYMENT)
+    await message.answer(
+        "💰 Выберите ученика для управления оплаченными занятиями:",
+        reply_markup=kb.as_markup(),
+    )
 
 
 @dp.callback_query(F.data.startswith("payment_select:"), IsAdminCallback)
@@ -249,16 +289,13 @@ async def process_payment_select(callback_query: types.CallbackQuery) -> None:
         return
 
     student_id = int(data[1])
-    db = SessionLocal()
-    try:
-        student = crud.get_student_by_id(db, student_id)
+    async with AsyncSessionLocal() as db:
+        student = await async_crud.get_student_by_id(db, student_id)
         if not student:
             await callback_query.answer("Ученик не найден")
             return
         student_summary = student.summary
         paid_count = student.paid_lessons_count
-    finally:
-        db.close()
 
     kb = _build_payment_keyboard(student_id)
     await callback_query.message.edit_text(
@@ -270,18 +307,16 @@ async def process_payment_select(callback_query: types.CallbackQuery) -> None:
     await callback_query.answer()
 
 
-async def _apply_paid_lessons_change(callback_query: types.CallbackQuery, student_id: int, new_count: int) -> None:
-    """Обновить количество оплаченных занятий и обновить сообщение."""
-    db = SessionLocal()
-    try:
-        updated_student = crud.update_student_paid_lessons(db, student_id, new_count)
+async def _apply_paid_lessons_change(callback_query: types.CallbackQuery, student_id: int, delta: int) -> None:
+    """Изменить количество оплаченных занятий на ``delta`` и обновить сообщение."""
+    async with AsyncSessionLocal() as db:
+        updated_student = await async_crud.change_student_paid_lessons(db, student_id, delta)
         if not updated_student:
-            await callback_query.answer("Ошибка при обновлении")
+            await callback_query.answer("Ученик не найден")
             return
         summary = updated_student.summary
         paid_count = updated_student.paid_lessons_count
-    finally:
-        db.close()
+    await lessons_view_cache.ainvalidate(redis_client, [student_id], admin=False)
 
     kb = _build_payment_keyboard(student_id)
     await callback_query.message.edit_text(
@@ -303,17 +338,7 @@ async def process_payment_add(callback_query: types.CallbackQuery) -> None:
     student_id = int(data[1])
     add_count = int(data[2])
 
-    db = SessionLocal()
-    try:
-        student = crud.get_student_by_id(db, student_id)
-        if not student:
-            await callback_query.answer("Ученик не найден")
-            return
-        new_count = student.paid_lessons_count + add_count
-    finally:
-        db.close()
-
-    await _apply_paid_lessons_change(callback_query, student_id, new_count)
+    await _apply_paid_lessons_change(callback_query, student_id, add_count)
 
 
 @dp.callback_query(F.data.startswith("payment_subtract:"), IsAdminCallback)
@@ -326,38 +351,19 @@ async def process_payment_subtract(callback_query: types.CallbackQuery) -> None:
     student_id = int(data[1])
     subtract_count = int(data[2])
 
-    db = SessionLocal()
-    try:
-        student = crud.get_student_by_id(db, student_id)
-        if not student:
-            await callback_query.answer("Ученик не найден")
-            return
-        new_count = max(0, student.paid_lessons_count - subtract_count)
-    finally:
-        db.close()
-
-    await _apply_paid_lessons_change(callback_query, student_id, new_count)
+    await _apply_paid_lessons_change(callback_query, student_id, -subtract_count)
 
 
 @dp.callback_query(F.data == "payment_back", IsAdminCallback)
 async def process_payment_back(callback_query: types.CallbackQuery) -> None:
     """Возврат к списку учеников в разделе /payment."""
-    db = SessionLocal()
-    try:
-        students = crud.list_students(db)
-        if not students:
-            await callback_query.message.edit_text("Нет учеников в базе.")
-            return
-        kb = InlineKeyboardBuilder()
-        for student in students:
-            kb.button(
-                text=f"{student.summary} ({student.paid_lessons_count} оплачено)",
-                callback_data=f"payment_select:{student.id}",
-            )
-        kb.adjust(1)
-    finally:
-        db.close()
+    async with AsyncSessionLocal() as db:
+        page = await load_students_page(db)
+    if not page.students:
+        await callback_query.message.edit_text("Нет учеников в базе.")
+        return
 
+    kb = build_students_page_keyboard(page, KIND_PAYMENT)
     await callback_query.message.edit_text(
         "💰 Выберите ученика для управления оплаченными занятиями:",
         reply_markup=kb.as_markup(),
@@ -366,7 +372,7 @@ async def process_payment_back(callback_query: types.CallbackQuery) -> None:
 
 
 @dp.callback_query(F.data.startswith("payment_set:"), IsAdminCallback)
-async def process_payment_set(callback_query: types.CallbackQuery) -> None:
+async def process_payment_set(callback_query: types.CallbackQuery, state: FSMContext) -> None:
     """Подготовить установку точного значения оплаченных занятий."""
     data = callback_query.data.split(":")
     if len(data) != 2:
@@ -374,19 +380,16 @@ async def process_payment_set(callback_query: types.CallbackQuery) -> None:
         return
     student_id = int(data[1])
 
-    db = SessionLocal()
-    try:
-        student = crud.get_student_by_id(db, student_id)
+    async with AsyncSessionLocal() as db:
+        student = await async_crud.get_student_by_id(db, student_id)
         if not student:
             await callback_query.answer("Ученик не найден")
             return
         student_summary = student.summary
         paid_count = student.paid_lessons_count
-    finally:
-        db.close()
 
-    admin_id = callback_query.from_user.id
-    _PENDING_PAYMENT_SET[admin_id] = student_id
+    await state.set_state(PaymentStates.waiting_for_value)
+    await state.update_data(student_id=student_id)
 
     await callback_query.message.answer(
         f"Введите новое количество оплаченных занятий для {student_summary}.\n"
@@ -396,32 +399,31 @@ async def process_payment_set(callback_query: types.CallbackQuery) -> None:
     await callback_query.answer("Ожидаю новое значение")
 
 
-@dp.message(IsAdmin, F.text == "/cancel")
-async def process_payment_set_cancel(message: types.Message) -> None:
+@dp.message(IsAdmin, F.text == "/cancel", PaymentStates.waiting_for_value)
+async def process_payment_set_cancel(message: types.Message, state: FSMContext) -> None:
     """Отмена режима установки точного количества занятий."""
-    if message.from_user.id in _PENDING_PAYMENT_SET:
-        _PENDING_PAYMENT_SET.pop(message.from_user.id, None)
-        await message.answer("Установка точного значения отменена.")
+    await state.clear()
+    await message.answer("Установка точного значения отменена.")
 
 
-@dp.message(IsAdmin, F.text.regexp(r"^\d+$"))
-async def process_payment_set_value(message: types.Message) -> None:
+@dp.message(IsAdmin, PaymentStates.waiting_for_value, F.text.regexp(r"^\d+$"))
+async def process_payment_set_value(message: types.Message, state: FSMContext) -> None:
     """Получить новое значение количества оплаченных занятий от администратора."""
     admin_id = message.from_user.id
-    if admin_id not in _PENDING_PAYMENT_SET:
-        return
-
     new_value = int(message.text)
-    student_id = _PENDING_PAYMENT_SET.pop(admin_id)
+    data = await state.get_data()
+    await state.clear()
+    student_id = data.get("student_id")
+    if student_id is None:
+        await message.answer("Ученик не выбран. Откройте /payment и выберите ученика заново.")
+        return
 
-    db = SessionLocal()
-    try:
-        updated_student = crud.update_student_paid_lessons(db, student_id, new_value)
+    async with AsyncSessionLocal() as db:
+        updated_student = await async_crud.update_student_paid_lessons(db, student_id, new_value)
         if not updated_student:
             await message.answer("Ошибка при обновлении данных ученика.")
             return
-    finally:
-        db.close()
+    await lessons_view_cache.ainvalidate(redis_client, [student_id], admin=False)
 
     kb = _build_payment_keyboard(student_id)
     await message.answer(
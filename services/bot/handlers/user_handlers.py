@@ -2,87 +2,99 @@
 Обработчики команд для обычных пользователей
 """
 from aiogram import types, F
-from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from bot import dp, bot, logger
+from bot import dp, bot, logger, redis_client
 from app.config import settings
-from app.db import SessionLocal
-from app import crud
+from app.db import AsyncSessionLocal
+from app.timeutil import format_local
+from app import async_crud, lessons_view_cache
+from keyboards import KIND_MAP, build_students_page_keyboard, load_students_page
 
 
 @dp.message(F.text == '/start')
 async def cmd_start_user(message: types.Message):
     """Обработчик команды /start для обычных пользователей"""
-    db = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db:
         # Проверяем, есть ли уже привязка у этого пользователя
-        student = crud.get_student_by_tg_user_id(db, str(message.from_user.id))
+        student = await async_crud.get_student_by_tg_user_id(db, str(message.from_user.id))
         logger.debug(f"Existing link for user {message.from_user.id}: {student}")
         if student:
-            # Сохраняем summary до закрытия сессии
-            student_summary = student.summary
-            db.close()
-            await message.answer(f'Привет! Вы уже привязаны к ученику: {student_summary}. Вы будете получать уведомления о занятиях.')
+            await message.answer(f'Привет! Вы уже привязаны к ученику: {student.summary}. Вы будете получать уведомления о занятиях.')
             return
 
         await message.answer('Привет! Спасибо, что подключились. Жду подтверждения от администратора.')
-        students = crud.list_students(db)
-        if not students:
+        page = await load_students_page(db)
+        if not page.students:
             await bot.send_message(settings.ADMIN_TELEGRAM_ID, 'Нет учеников в базе. Пожалуйста, запустите воркер и попробуйте позже.')
             return
-        kb = InlineKeyboardBuilder()
-        for s in students:
-            kb.button(text=s.summary, callback_data=f"map:{message.from_user.id}:{s.id}")
-        kb.adjust(1)
+        kb = build_students_page_keyboard(page, KIND_MAP, tg_user_id=str(message.from_user.id))
         await bot.send_message(
             settings.ADMIN_TELEGRAM_ID,
             f"Пользователь @{message.from_user.username} ({message.from_user.id}) просит привязку. Выберите ученика:",
             reply_markup=kb.as_markup(),
         )
-    finally:
-        db.close()
+
+
+async def _lessons_text(db, student) -> tuple[str, int]:
+    """Текст ответа /lessons для ученика и срок его хранения в кэше."""
+    # Получаем предстоящие уроки для этого ученика
+    lessons = await async_crud.get_lessons_for_student(db, student.id, upcoming_only=True, limit=10)
+
+    if not lessons:
+        response = (
+            f'📚 {student.summary}\n\n'
+            f'На данный момент нет запланированных уроков.\n'
+            f'Оплаченных занятий: {student.paid_lessons_count}'
+        )
+        return response, lessons_view_cache.ttl_seconds(lessons)
+
+    # Формируем сообщение со списком уроков
+    response = f'📚 Предстоящие уроки для {student.summary}\n'
+    response += f'💳 Оплаченных занятий: {student.paid_lessons_count}\n\n'
+
+    for i, lesson in enumerate(lessons, 1):
+        # Форматируем дату и время
+        start_str = format_local(lesson.start)
+        paid_mark = '✅' if lesson.is_paid else '⏳'
+
+        response += f'{i}. {paid_mark} {lesson.summary}\n'
+        response += f'   📅 {start_str}\n'
+        response += f'   🆔 ID: {lesson.id}\n\n'
+    return response, lessons_view_cache.ttl_seconds(lessons)
 
 
 @dp.message(F.text == '/lessons')
 async def cmd_lessons(message: types.Message):
     """Показать список предстоящих уроков для пользователя"""
-    db = SessionLocal()
-    try:
+    tg_user_id = str(message.from_user.id)
+    # Привязка пользователя к ученику и готовый ответ берутся из Redis, если есть
+    student_id = await lessons_view_cache.aget(redis_client, lessons_view_cache.tg_student_key(tg_user_id))
+    if student_id is not None:
+        cached = await lessons_view_cache.aget(redis_client, lessons_view_cache.student_key(int(student_id)))
+        if cached is not None:
+            await message.answer(cached)
+            return
+
+    generation = await lessons_view_cache.ageneration(redis_client)
+    async with AsyncSessionLocal() as db:
         # Проверяем, привязан ли пользователь к ученику
-        student = crud.get_student_by_tg_user_id(db, str(message.from_user.id))
-        
+        student = await async_crud.get_student_by_tg_user_id(db, tg_user_id)
+
         if not student:
             await message.answer(
                 '❌ Вы не привязаны ни к одному ученику.\n'
                 'Используйте /start для подключения.'
             )
             return
-        
-        # Получаем предстоящие уроки для этого ученика
-        lessons = crud.get_lessons_for_student(db, student.id, upcoming_only=True, limit=10)
-        
-        if not lessons:
-            await message.answer(
-                f'📚 {student.summary}\n\n'
-                f'На данный момент нет запланированных уроков.\n'
-                f'Оплаченных занятий: {student.paid_lessons_count}'
-            )
-            return
-        
-        # Формируем сообщение со списком уроков
-        response = f'📚 Предстоящие уроки для {student.summary}\n'
-        response += f'💳 Оплаченных занятий: {student.paid_lessons_count}\n\n'
-        
-        for i, lesson in enumerate(lessons, 1):
-            # Форматируем дату и время
-            start_str = lesson.start.strftime('%d.%m.%Y %H:%M')
-            paid_mark = '✅' if lesson.is_paid else '⏳'
-            
-            response += f'{i}. {paid_mark} {lesson.summary}\n'
-            response += f'   📅 {start_str}\n'
-            response += f'   🆔 ID: {lesson.id}\n\n'
-        
-        await message.answer(response)
-        
-    finally:
-        db.close()
\ No newline at end of file
+
+        response, ttl = await _lessons_text(db, student)
+
+    await lessons_view_cache.astore(
+        redis_client,
+        lessons_view_cache.tg_student_key(tg_user_id),
+        student.id,
+        settings.LESSONS_VIEW_TTL_SECONDS,
+        generation,
+    )
+    await lessons_view_cache.astore(redis_client, lessons_view_cache.student_key(student.id), response, ttl, generation)
+    await message.answer(response)
@@ -0,0 +1,85 @@
+"""Постраничные клавиатуры со списком учеников.
+
+Каждая страница — один запрос ``async_crud.list_students_page`` (keyset по
+``(summary, id)``) и не больше ``PAGE_SIZE`` кнопок, сколько бы учеников ни
+было. Кнопки навигации несут только id крайнего ученика страницы:
+``stpage:<kind>:<next|prev>:<student_id>[:<tg_user_id>]``.
+"""
+from __future__ import annotations
+
+from typing import Final
+
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import async_crud
+
+PAGE_SIZE: Final[int] = 10
+
+# Виды списков: активность, оплата, привязка пользователя, текстовый список /students
+KIND_TOGGLE: Final[str] = "toggle"
+KIND_PAYMENT: Final[str] = "pay"
+KIND_MAP: Final[str] = "map"
+KIND_LIST: Final[str] = "list"
+
+
+def format_status(is_active: bool) -> str:
+    return "✅ Активен" if is_active else "❌ Неактивен"
+
+
+def format_students_list(students, include_paid: bool = True) -> str:
+    """Сформировать человекочитаемый список учеников."""
+    lines: list[str] = []
+    for student in students:
+        paid = f"\n  Оплаченных занятий: {student.paid_lessons_count}" if include_paid else ""
+        lines.append(f"• {student.summary}\n  Статус: {format_status(student.is_active)}{paid}")
+    return "\n\n".join(lines)
+
+
+async def load_students_page(
+    db: AsyncSession,
+    cursor_id: int | None = None,
+    direction: str = "next",
+    prefix: str | None = None,
+) -> async_crud.StudentPage:
+    """Страница учеников; если курсор устарел (ученик удалён, страница пуста) — первая."""
+    page = await async_crud.list_students_page(db, PAGE_SIZE, cursor_id, direction, prefix)
+    if not page.students and cursor_id is not None:
+        page = await async_crud.list_students_page(db, PAGE_SIZE, prefix=prefix)
+    return page
+
+
+def build_students_page_keyboard(
+    page: async_crud.StudentPage,
+    kind: str,
+    tg_user_id: str | None = None,
+) -> InlineKeyboardBuilder:
+    """Кнопки учеников страницы (для ``kind``) и кнопки «назад/вперёд»."""
+    kb = InlineKeyboardBuilder()
+    students = page.students
+    page_start = students[0].id if students else 0
+    for student in students:
+        if kind == KIND_TOGGLE:
+            kb.button(
+                text=f"{student.summary} ({format_status(student.is_active)})",
+                callback_data=f"toggle_active:{student.id}:{page_start}",
+            )
+        elif kind == KIND_PAYMENT:
+            kb.button(
+                text=f"{student.summary} ({student.paid_lessons_count} оплачено)",
+                callback_data=f"payment_select:{student.id}",
+            )
+        elif kind == KIND_MAP:
+            kb.button(text=student.summary, callback_data=f"map:{tg_user_id}:{student.id}")
+
+    suffix = f":{tg_user_id}" if kind == KIND_MAP else ""
+    nav = 0
+    if page.has_prev and students:
+        kb.button(text="◀️ Назад", callback_data=f"stpage:{kind}:prev:{students[0].id}{suffix}")
+        nav += 1
+    if page.has_next and students:
+        kb.button(text="Вперёд ▶️", callback_data=f"stpage:{kind}:next:{students[-1].id}{suffix}")
+        nav += 1
+    item_rows = 0 if kind == KIND_LIST else len(students)
+    kb.adjust(*([1] * item_rows), *([nav] if nav else []))
+    return kb
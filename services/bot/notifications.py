@@ -0,0 +1,85 @@
+"""Напоминания об уроках: ученикам — каждому своё, администратору — одна сводка.
+
+Используется эндпоинтами ``/notify`` (один урок) и ``/notify_batch``
+(уроки, начинающиеся в одно время): все уроки загружаются одним запросом,
+сообщения уходят через общий ``SendEngine``.
+"""
+from __future__ import annotations
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import async_crud
+from app.config import settings
+from app.timeutil import format_local
+from bot import logger, sender
+
+
+def _student_text(lesson) -> str:
+    return f"Урок: {lesson.summary}\nНачало: {format_local(lesson.start)}\nID: {lesson.id}"
+
+
+def _admin_text(lessons, sent_by_lesson: dict[int, int]) -> str:
+    """Одна сводка для администратора по всем урокам пачки."""
+    if len(lessons) == 1:
+        lesson = lessons[0]
+        student = lesson.student
+        return (
+            f"📅 Напоминание об уроке\n\n"
+            f"Ученик: {student.summary if student else 'Неизвестный ученик'}\n"
+            f"Урок: {lesson.summary}\n"
+            f"Начало: {format_local(lesson.start)}\n"
+            f"Оставшихся оплаченных занятий: {student.paid_lessons_count if student else 0}\n"
+            f"ID урока: {lesson.id}\n\n"
+            f"Уведомление отправлено {sent_by_lesson[lesson.id]} пользователям."
+        )
+    lines = [f"📅 Напоминание об уроках ({len(lessons)})", ""]
+    for lesson in lessons:
+        student = lesson.student
+        lines.append(f"• {student.summary if student else 'Неизвестный ученик'} — {lesson.summary}")
+        lines.append(f"  Начало: {format_local(lesson.start)}")
+        lines.append(f"  Оставшихся оплаченных занятий: {student.paid_lessons_count if student else 0}")
+        lines.append(f"  Уведомлено пользователей: {sent_by_lesson[lesson.id]}")
+        lines.append(f"  ID урока: {lesson.id}")
+        lines.append("")
+    return "\n".join(lines).strip()
+
+
+async def notify_lessons(db: AsyncSession, lesson_ids) -> dict:
+    """Разослать напоминания по урокам и одну сводку администратору.
+
+    Returns: {"lessons": [найденные id], "missing": [ненайденные id],
+              "sent": <всего доставлено>, "admin_notified": <bool>}
+    """
+    lesson_ids = list(dict.fromkeys(lesson_ids))
+    lessons = await async_crud.get_lessons_notification(db, lesson_ids)
+    found = {lesson.id for lesson in lessons}
+    missing = [lesson_id for lesson_id in lesson_ids if lesson_id not in found]
+    if missing:
+        logger.warning(f"Lessons not found for notification: {missing}")
+    if not lessons:
+        return {"lessons": [], "missing": missing, "sent": 0, "admin_notified": False}
+
+    # Все сообщения ученикам — одним вызовом send_many
+    messages: list[tuple[int, str]] = []
+    owners: list[int] = []
+    for lesson in lessons:
+        links = lesson.student.tg_links if lesson.student else []
+        text = _student_text(lesson)
+        for link in links:
+            messages.append((int(link.tg_user_id), text))
+            owners.append(lesson.id)
+    results = await sender.send_many(messages)
+
+    sent_by_lesson = dict.fromkeys(found, 0)
+    for lesson_id, ok in zip(owners, results):
+        sent_by_lesson[lesson_id] += ok
+
+    admin_notified = await sender.send(settings.ADMIN_TELEGRAM_ID, _admin_text(lessons, sent_by_lesson))
+    if not admin_notified:
+        logger.warning("Failed to send admin notification")
+    return {
+        "lessons": [lesson.id for lesson in lessons],
+        "missing": missing,
+        "sent": sum(results),
+        "admin_notified": admin_notified,
+    }
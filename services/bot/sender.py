@@ -0,0 +1,200 @@
+"""Параллельная отправка сообщений с соблюдением лимитов Telegram.
+
+Telegram ограничивает бота примерно 30 сообщениями в секунду суммарно и
+около одного сообщения в секунду в один чат. ``SendEngine`` отправляет
+сообщения параллельно (не больше ``concurrency`` одновременных запросов),
+а темп держит двумя уровнями token bucket: общим и по каждому чату.
+При ``TelegramRetryAfter`` ставится на паузу только затронутый чат —
+остальные продолжают отправляться, а сообщение отправляется повторно
+после паузы.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger('bot')
+
+# Чаты, не использовавшиеся дольше этого, удаляются из таблицы лимитов
+_IDLE_CHAT_SECONDS = 300
+# Предельная длина сообщения Telegram (в единицах UTF-16)
+MESSAGE_LIMIT = 4096
+
+
+def _utf16_len(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> list[str]:
+    """Разбить текст на части не длиннее ``limit``, по возможности по переводам строк."""
+    chunks = []
+    while _utf16_len(text) > limit:
+        cut = limit
+        while (excess := _utf16_len(text[:cut]) - limit) > 0:
+            # Символ занимает одну или две единицы UTF-16
+            cut -= (excess + 1) // 2
+        newline = text.rfind("\n", 0, cut)
+        if newline > 0:
+            cut = newline
+        chunks.append(text[:cut])
+        text = text[cut + 1:] if text[cut] == "\n" else text[cut:]
+    chunks.append(text)
+    return chunks
+
+
+class TokenBucket:
+    """Token bucket: ``rate`` токенов в секунду, не больше ``capacity`` в запасе."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Забрать токен; вернуть, сколько секунд нужно подождать до его появления."""
+        now = time.monotonic()
+        self._refill(now)
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+    @property
+    def idle_since(self) -> float:
+        return self._updated
+
+
+class SendEngine:
+    """Отправка сообщений через общий пул с лимитами и повтором после flood control."""
+
+    def __init__(
+        self,
+        bot: Bot,
+        concurrency: int = 10,
+        global_rate: float = 25.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        max_retries: int = 3,
+    ):
+        self._bot = bot
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chats: dict[int, TokenBucket] = {}
+        self._paused_until: dict[int, float] = {}
+        self._max_retries = max_retries
+        self._queued = 0
+        self._in_flight = 0
+        self._counters = {
+            "sent": 0,
+            "failed": 0,
+            "retry_after": 0,
+            "throttled": 0,
+        }
+        self._throttled_seconds = 0.0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 1000:
+                self._forget_idle_chats()
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        return bucket
+
+    def _forget_idle_chats(self) -> None:
+        threshold = time.monotonic() - _IDLE_CHAT_SECONDS
+        for chat_id in [cid for cid, b in self._chats.items() if b.idle_since < threshold]:
+            del self._chats[chat_id]
+        for chat_id in [cid for cid, until in self._paused_until.items() if until < threshold]:
+            del self._paused_until[chat_id]
+
+    async def _throttle(self, delay: float) -> None:
+        if delay > 0:
+            self._counters["throttled"] += 1
+            self._throttled_seconds += delay
+            await asyncio.sleep(delay)
+
+    async def _wait_for_chat(self, chat_id: int) -> None:
+        """Дождаться конца паузы flood control и токена чата."""
+        paused = self._paused_until.get(chat_id, 0.0) - time.monotonic()
+        await self._throttle(paused)
+        await self._throttle(self._chat_bucket(chat_id).reserve())
+
+    async def send(self, chat_id: int, text: str, **kwargs) -> bool:
+        """Отправить сообщение; вернуть True при успехе.
+
+        Ошибки доставки (бот заблокирован, чат не найден и т.п.) не
+        пробрасываются, а логируются и учитываются в метриках.
+        """
+        return await self.send_or_error(chat_id, text, **kwargs) is None
+
+    async def send_or_error(self, chat_id: int, text: str, **kwargs) -> str | None:
+        """То же, что ``send``, но вернуть причину неудачи (None — отправлено).
+
+        Текст длиннее ``MESSAGE_LIMIT`` уходит несколькими сообщениями по
+        порядку; ``kwargs`` (например, клавиатура) — у последнего.
+        """
+        chunks = split_message(text)
+        for idx, chunk in enumerate(chunks):
+            error = await self._send_chunk(chat_id, chunk, **(kwargs if idx == len(chunks) - 1 else {}))
+            if error is not None:
+                return error
+        return None
+
+    async def _send_chunk(self, chat_id: int, text: str, **kwargs) -> str | None:
+        self._queued += 1
+        try:
+            for attempt in range(self._max_retries + 1):
+                # Ожидание своего чата — вне семафора, чтобы не занимать слот отправки
+                await self._wait_for_chat(chat_id)
+                async with self._semaphore:
+                    await self._throttle(self._global.reserve())
+                    self._in_flight += 1
+                    try:
+                        await self._bot.send_message(chat_id, text, **kwargs)
+                    except TelegramRetryAfter as e:
+                        self._counters["retry_after"] += 1
+                        self._paused_until[chat_id] = time.monotonic() + e.retry_after
+                        logger.warning(
+                            f"Flood control for chat {chat_id}: pausing it for {e.retry_after}s "
+                            f"(attempt {attempt + 1}/{self._max_retries + 1})"
+                        )
+                        continue
+                    except Exception as e:  # noqa: BLE001
+                        self._counters["failed"] += 1
+                        logger.debug(f"Failed to deliver to {chat_id}: {e}")
+                        return str(e)
+                    finally:
+                        self._in_flight -= 1
+                self._counters["sent"] += 1
+                return None
+            self._counters["failed"] += 1
+            logger.warning(f"Giving up on chat {chat_id} after {self._max_retries} flood control retries")
+            return f"flood control: gave up after {self._max_retries} retries"
+        finally:
+            self._queued -= 1
+
+    async def send_many(self, messages: list[tuple[int, str]]) -> list[bool]:
+        """Отправить несколько сообщений параллельно; результаты в том же порядке."""
+        return list(await asyncio.gather(*(self.send(chat_id, text) for chat_id, text in messages)))
+
+    def metrics(self) -> dict:
+        now = time.monotonic()
+        return {
+            # Сообщения, ещё не отправленные (ждут лимита, слота или паузы чата)
+            "queue_depth": self._queued - self._in_flight,
+            "in_flight": self._in_flight,
+            **self._counters,
+            "throttled_seconds": round(self._throttled_seconds, 3),
+            "paused_chats": sum(1 for until in self._paused_until.values() if until > now),
+        }
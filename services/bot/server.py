@@ -4,31 +4,45 @@ Clean version after removing corrupted merge/noise.
 
 Endpoints:
   POST /notify {"lesson_id": <int>} - send notification about a lesson to all linked TG users
+  POST /notify_batch {"lesson_ids": [<int>, ...]} - same for several lessons, one admin summary
+  POST /admin_notify {"message": <str>} - send a message to the admin
+  GET  /metrics - send engine counters (queue depth, throttling), student cache hit rate
   GET  /health - liveness probe
+  POST BOT_WEBHOOK_PATH - Telegram updates (webhook mode only)
 
-On startup: launches aiogram polling in background with exponential backoff.
+Telegram updates are received in one of two modes (BOT_MODE):
+  polling - aiogram polling as a background task with exponential backoff;
+            one process only, handy for development.
+  webhook - Telegram posts updates to BOT_WEBHOOK_PATH, validated by the
+            secret token; any number of uvicorn workers or containers can
+            serve them behind a load balancer.
+
+On startup also launches the consumer of the Redis stream ``notify_stream``
+(notifications queued by Celery).
 """
 from __future__ import annotations
 
 import asyncio
+import hmac
 import logging
-from fastapi import FastAPI, HTTPException, Body, Depends
+from aiogram.types import Update
+from fastapi import FastAPI, HTTPException, Body, Depends, Header, Request
 
-from bot import bot, dp, logger  # logger configured in bot.py
-from app.db import SessionLocal, engine
-from app import models, crud
+from bot import bot, dp, logger, sender  # logger configured in bot.py
+from app.db import AsyncSessionLocal, async_engine
+from app import migrate, student_cache
+from app.config import settings
+from notifications import notify_lessons
+from stream_consumer import consume_forever
 
-# Ensure DB schema is created (idempotent)
-models.Base.metadata.create_all(bind=engine)
+# Bring the DB schema up to date (Alembic migrations, serialized by an advisory lock)
+migrate.upgrade()
 
 
-def get_db():
-    """FastAPI dependency providing a SQLAlchemy session."""
-    db = SessionLocal()
-    try:
+async def get_db():
+    """FastAPI dependency providing an async SQLAlchemy session."""
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 app = FastAPI(title="YA Calendar Bot Server")
@@ -39,6 +53,7 @@ import handlers.admin_handlers  # noqa: E402,F401  pylint: disable=unused-import
 import handlers.user_handlers   # noqa: E402,F401  pylint: disable=unused-import
 
 _polling_task: asyncio.Task | None = None
+_consumer_task: asyncio.Task | None = None
 
 
 async def _polling_loop():
@@ -47,6 +62,8 @@ async def _polling_loop():
     max_delay = 60
     while True:
         try:
+            # getUpdates не работает, пока установлен webhook
+            await bot.delete_webhook()
             await dp.start_polling(bot)
             break  # normal shutdown
         except Exception as e:  # noqa: BLE001
@@ -55,23 +72,64 @@ async def _polling_loop():
             delay = min(delay * 2, max_delay)
 
 
+async def _setup_webhook():
+    """Register the webhook with Telegram.
+
+    Called on every startup: getWebhookInfo does not return the secret token,
+    so a rotated BOT_WEBHOOK_SECRET can't be detected; setWebhook is idempotent.
+    """
+    url = settings.BOT_WEBHOOK_URL.rstrip("/") + settings.BOT_WEBHOOK_PATH
+    if not settings.BOT_WEBHOOK_SECRET:
+        # Без секрета любой, кто узнал URL, может прислать обновление от имени администратора
+        raise RuntimeError("BOT_WEBHOOK_SECRET must be set when BOT_MODE=webhook")
+    await bot.set_webhook(url, secret_token=settings.BOT_WEBHOOK_SECRET)
+    logger.info("Webhook set to %s", url)
+
+
 @app.on_event("startup")
 async def on_startup():
-    global _polling_task
-    logger.info("Starting polling background task")
-    _polling_task = asyncio.create_task(_polling_loop())
+    global _polling_task, _consumer_task
+    if settings.BOT_MODE == "webhook":
+        await _setup_webhook()
+    else:
+        logger.info("Starting polling background task")
+        _polling_task = asyncio.create_task(_polling_loop())
+    # Поток уведомлений читаем всегда: в нём могут остаться записи после смены NOTIFY_TRANSPORT
+    _consumer_task = asyncio.create_task(consume_forever())
 
 
 @app.on_event("shutdown")
 async def on_shutdown():
-    global _polling_task
-    if _polling_task and not _polling_task.done():
-        logger.info("Shutting down polling task")
-        _polling_task.cancel()
+    for name, task in (("polling", _polling_task), ("notify stream consumer", _consumer_task)):
+        if task and not task.done():
+            logger.info("Shutting down %s task", name)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:  # noqa: PERF203
+                pass
+    await async_engine.dispose()
+
+
+if settings.BOT_MODE == "webhook":
+
+    @app.post(settings.BOT_WEBHOOK_PATH, include_in_schema=False)
+    async def telegram_webhook(
+        request: Request,
+        secret_token: str | None = Header(None, alias="X-Telegram-Bot-Api-Secret-Token"),
+    ):
+        """Feed a Telegram update to the dispatcher."""
+        if not settings.BOT_WEBHOOK_SECRET or not hmac.compare_digest(
+            secret_token or "", settings.BOT_WEBHOOK_SECRET
+        ):
+            raise HTTPException(status_code=403, detail="invalid secret token")
+        update = Update.model_validate(await request.json(), context={"bot": bot})
         try:
-            await _polling_task
-        except asyncio.CancelledError:  # noqa: PERF203
-            pass
+            await dp.feed_update(bot, update)
+        except Exception as e:  # noqa: BLE001
+            # Ответ не 200 заставит Telegram повторять это обновление
+            logger.error("Failed to handle update %s: %s", update.update_id, e, exc_info=True)
+        return {"ok": True}
 
 
 @app.post("/notify")
@@ -81,51 +139,20 @@ async def notify(lesson_id: int = Body(..., embed=True), db=Depends(get_db)):
     Body: {"lesson_id": <int>}
     Returns: {"sent": <int>, "admin_notified": <bool>}
     """
-    from app.config import settings
-    
-    lesson = crud.get_lesson(db, lesson_id)
-    if not lesson:
+    result = await notify_lessons(db, [lesson_id])
+    if not result["lessons"]:
         raise HTTPException(status_code=404, detail="lesson not found")
+    return {"sent": result["sent"], "admin_notified": result["admin_notified"]}
 
-    links = crud.get_links_for_student(db, lesson.student_id)
-    
-    # Сообщение для учеников
-    student_text = f"Урок: {lesson.summary}\nНачало: {lesson.start}\nID: {lesson.id}"
-    
-    # Отправляем ученикам
-    sent = 0
-    for link in links:
-        try:
-            await bot.send_message(int(link.tg_user_id), student_text)
-            sent += 1
-        except Exception as e:  # noqa: BLE001
-            logging.debug("Failed to deliver to %s: %s", link.tg_user_id, e)
-            continue
-
-    # Отправляем админу
-    admin_notified = False
-    try:
-        # Получаем информацию о ученике для админа
-        student_info = crud.get_student_by_id(db, lesson.student_id)
-        student_name = student_info.summary if student_info else "Неизвестный ученик"
-        remaining_lessons = student_info.paid_lessons_count if student_info else 0
-        
-        admin_text = (
-            f"📅 Напоминание об уроке\n\n"
-            f"Ученик: {student_name}\n"
-            f"Урок: {lesson.summary}\n"
-            f"Начало: {lesson.start}\n"
-            f"Оставшихся оплаченных занятий: {remaining_lessons}\n"
-            f"ID урока: {lesson.id}\n\n"
-            f"Уведомление отправлено {sent} пользователям."
-        )
-        
-        await bot.send_message(settings.ADMIN_TELEGRAM_ID, admin_text)
-        admin_notified = True
-    except Exception as e:  # noqa: BLE001
-        logging.warning("Failed to send admin notification: %s", e)
-
-    return {"sent": sent, "admin_notified": admin_notified}
+
+@app.post("/notify_batch")
+async def notify_batch(lesson_ids: list[int] = Body(..., embed=True), db=Depends(get_db)):
+    """Notify about several lessons at once; the admin gets one combined summary.
+
+    Body: {"lesson_ids": [<int>, ...]}
+    Returns: {"lessons": [<id>, ...], "missing": [<id>, ...], "sent": <int>, "admin_notified": <bool>}
+    """
+    return await notify_lessons(db, lesson_ids)
 
 
 @app.post("/admin_notify")
@@ -133,16 +160,19 @@ async def admin_notify(message: str = Body(..., embed=True)):
     """Send notification message to admin.
     
     Body: {"message": "<text>"}
-    Returns: {"sent": <bool>}
+    Returns: {"sent": <bool>, "error": <str, only on failure>}
     """
-    from app.config import settings
-    
-    try:
-        await bot.send_message(settings.ADMIN_TELEGRAM_ID, message)
-        return {"sent": True}
-    except Exception as e:
-        logging.warning("Failed to send admin notification: %s", e)
-        return {"sent": False, "error": str(e)}
+    error = await sender.send_or_error(settings.ADMIN_TELEGRAM_ID, message)
+    if error is not None:
+        logging.warning("Failed to send admin notification: %s", error)
+        return {"sent": False, "error": error}
+    return {"sent": True}
+
+
+@app.get("/metrics")
+def metrics():
+    """Send engine counters (queue depth, throttling, flood control) and student cache hit rate."""
+    return {"sender": sender.metrics(), "student_cache": student_cache.stats()}
 
 
 @app.get("/health")
@@ -0,0 +1,14 @@
+"""
+Состояния многошаговых диалогов администратора (aiogram FSM).
+
+Состояние и данные хранятся в Redis (``RedisStorage`` в ``bot.py``), поэтому
+ответ администратора может обработать любой процесс бота, а незавершённый
+диалог переживает перезапуск и сам истекает через ``BOT_FSM_TTL_SECONDS``.
+"""
+from aiogram.fsm.state import State, StatesGroup
+
+
+class PaymentStates(StatesGroup):
+    """Установка точного количества оплаченных занятий (данные: ``student_id``)."""
+
+    waiting_for_value = State()
@@ -0,0 +1,132 @@
+"""Потребитель потока уведомлений ``notify_stream`` (см. ``app/notify_stream.py``).
+
+Читает записи пачками через группу потребителей, отправляет их через
+``SendEngine`` и подтверждает (``XACK``). Напоминания об уроках из одной
+пачки объединяются в один вызов ``notify_lessons`` — администратор
+получает одну сводку. Следующая пачка читается только после обработки
+текущей, поэтому при медленной отправке записи копятся в Redis, а не в
+памяти бота.
+
+Записи, которые упавший потребитель не подтвердил, забираются
+(``XCLAIM``) после ``NOTIFY_STREAM_CLAIM_IDLE_SECONDS``; запись,
+доставленная больше ``NOTIFY_STREAM_MAX_DELIVERIES`` раз, подтверждается
+без отправки и попадает в лог.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+
+from redis.exceptions import ResponseError
+
+from app.config import settings
+from app.db import AsyncSessionLocal
+from app.notify_stream import NOTIFY_STREAM_GROUP, NOTIFY_STREAM_KEY, decode_fields, parse_lesson_ids
+from bot import logger, redis_client, sender
+from notifications import notify_lessons
+
+# Как часто проверять зависшие записи других потребителей
+_CLAIM_INTERVAL_SECONDS = 30
+# Сколько ждать новых записей в XREADGROUP
+_BLOCK_MS = 5000
+
+
+def _consumer_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+async def _ensure_group() -> None:
+    try:
+        await redis_client.xgroup_create(NOTIFY_STREAM_KEY, NOTIFY_STREAM_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def _process(entries) -> None:
+    """Отправить пачку записей и подтвердить её."""
+    lesson_ids: list[int] = []
+    admin_messages: list[str] = []
+    for entry_id, raw in entries:
+        fields = decode_fields(raw)
+        kind = fields.get("type")
+        if kind == "lessons":
+            lesson_ids.extend(parse_lesson_ids(fields.get("lesson_ids", "")))
+        elif kind == "admin":
+            admin_messages.append(fields.get("message", ""))
+        else:
+            logger.warning(f"Unknown notify stream entry {entry_id}: {fields}")
+
+    if lesson_ids:
+        async with AsyncSessionLocal() as db:
+            result = await notify_lessons(db, lesson_ids)
+        logger.info(f"Stream notification sent for lesson_ids={lesson_ids}: {result}")
+    if admin_messages:
+        await asyncio.gather(*(sender.send(settings.ADMIN_TELEGRAM_ID, text) for text in admin_messages))
+
+    await redis_client.xack(NOTIFY_STREAM_KEY, NOTIFY_STREAM_GROUP, *(entry_id for entry_id, _ in entries))
+
+
+async def _claim_stale(consumer: str) -> list:
+    """Забрать записи, зависшие у упавших потребителей; отбросить «ядовитые»."""
+    idle_ms = settings.NOTIFY_STREAM_CLAIM_IDLE_SECONDS * 1000
+    pending = await redis_client.xpending_range(
+        NOTIFY_STREAM_KEY,
+        NOTIFY_STREAM_GROUP,
+        min="-",
+        max="+",
+        count=settings.NOTIFY_STREAM_BATCH_SIZE,
+        idle=idle_ms,
+    )
+    if not pending:
+        return []
+    poisoned = [p["message_id"] for p in pending if p["times_delivered"] >= settings.NOTIFY_STREAM_MAX_DELIVERIES]
+    if poisoned:
+        logger.error(f"Dropping notify stream entries after {settings.NOTIFY_STREAM_MAX_DELIVERIES} deliveries: {poisoned}")
+        await redis_client.xack(NOTIFY_STREAM_KEY, NOTIFY_STREAM_GROUP, *poisoned)
+    retry = [p["message_id"] for p in pending if p["message_id"] not in poisoned]
+    if not retry:
+        return []
+    claimed = await redis_client.xclaim(NOTIFY_STREAM_KEY, NOTIFY_STREAM_GROUP, consumer, idle_ms, retry)
+    # Записи, удалённые из потока по MAXLEN, возвращаются с пустыми полями
+    claimed = [(entry_id, fields) for entry_id, fields in claimed if fields]
+    if claimed:
+        logger.info(f"Reclaimed {len(claimed)} pending notify stream entries")
+    return claimed
+
+
+async def consume_forever() -> None:
+    """Основной цикл потребителя; ошибки логируются, цикл продолжается."""
+    consumer = _consumer_name()
+    delay = 1
+    last_claim = 0.0
+    loop = asyncio.get_running_loop()
+    logger.info(f"Notify stream consumer {consumer} started")
+    while True:
+        try:
+            await _ensure_group()
+            while True:
+                if loop.time() - last_claim >= _CLAIM_INTERVAL_SECONDS:
+                    last_claim = loop.time()
+                    claimed = await _claim_stale(consumer)
+                    if claimed:
+                        await _process(claimed)
+                response = await redis_client.xreadgroup(
+                    NOTIFY_STREAM_GROUP,
+                    consumer,
+                    {NOTIFY_STREAM_KEY: ">"},
+                    count=settings.NOTIFY_STREAM_BATCH_SIZE,
+                    block=_BLOCK_MS,
+                )
+                for _, entries in response or []:
+                    if entries:
+                        await _process(entries)
+                delay = 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:  # noqa: BLE001
+            # Неподтверждённые записи останутся в pending и будут забраны позже
+            logger.warning(f"Notify stream consumer error: {e}. Retrying in {delay} seconds", exc_info=True)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
@@ -0,0 +1,98 @@
+"""Диспетчер отложенных задач: переносит наступившие элементы ``due_queue`` в Celery
+и периодически ставит списание за завершённые уроки."""
+import logging
+import time
+
+import redis
+from celery import Celery
+
+from app import due_queue
+from app.config import settings
+from app.logging_config import setup_root_logging
+
+logger = setup_root_logging('dispatcher', log_level=logging.INFO)
+
+celery = Celery('dispatcher', broker=settings.REDIS_URL, backend=settings.REDIS_URL)
+celery.conf.accept_content = ['json']
+celery.conf.result_serializer = 'json'
+celery.conf.task_serializer = 'json'
+
+r = redis.Redis.from_url(settings.REDIS_URL)
+
+SETTLE_TASK = "tasks.settle_completed_lessons"
+_SETTLE_TICK_KEY = "settle:tick"
+
+
+def _group_due(items: list[tuple[str, float]]) -> list[tuple[str, list, list[tuple[str, float]]]]:
+    """Разбить наступившие элементы на задачи: [(task_name, args, items), ...].
+
+    Напоминания из одного окна NOTIFY_BATCH_WINDOW_SECONDS объединяются в
+    одну задачу ``tasks.send_notify_batch``, остальное идёт по одной задаче.
+    """
+    window = max(settings.NOTIFY_BATCH_WINDOW_SECONDS, 1)
+    groups = []
+    notify_buckets: dict[int, tuple[list, list]] = {}
+    for member, score in items:
+        kind, lesson_id, version = due_queue.parse_member(member)
+        if kind == "notify":
+            batch, batch_items = notify_buckets.setdefault(int(score // window), ([], []))
+            batch.append([lesson_id, int(version)])
+            batch_items.append((member, score))
+            continue
+        task_name = due_queue.TASKS_BY_KIND.get(kind)
+        if task_name is None:
+            logger.warning(f"Unknown due queue item kind: {member}")
+            continue
+        groups.append((task_name, [lesson_id, int(version)], [(member, score)]))
+    for batch, batch_items in notify_buckets.values():
+        groups.append((due_queue.NOTIFY_BATCH_TASK, [batch], batch_items))
+    return groups
+
+
+def dispatch_due() -> int:
+    """Отправить в Celery все наступившие задачи (не больше одной пачки)."""
+    now = time.time()
+    requeued = due_queue.requeue_expired(r, now)
+    if requeued:
+        logger.warning(f"Requeued {requeued} due queue item(s) with expired lease")
+    items = due_queue.pop_due(r, now, settings.DISPATCHER_BATCH_SIZE, settings.DISPATCHER_LEASE_SECONDS)
+    groups = _group_due(items)
+    # Элементы неизвестного вида в задачи не попали — снимаем аренду сразу
+    grouped = {member for _, _, group_items in groups for member, _ in group_items}
+    due_queue.ack(r, [item for item in items if item[0] not in grouped])
+    for idx, (task_name, args, group_items) in enumerate(groups):
+        try:
+            celery.send_task(task_name, args=args)
+        except Exception:
+            due_queue.requeue(r, [item for _, _, rest in groups[idx:] for item in rest])
+            raise
+        due_queue.ack(r, group_items)
+        logger.info(f"Dispatched {task_name} for {len(group_items)} item(s): {[m for m, _ in group_items]}")
+    return len(items)
+
+
+def maybe_dispatch_settle() -> bool:
+    """Поставить задачу списания, если за последний интервал её ещё никто не ставил."""
+    interval = max(int(settings.SETTLE_INTERVAL_SECONDS), 1)
+    if not r.set(_SETTLE_TICK_KEY, 1, nx=True, ex=interval):
+        return False
+    celery.send_task(SETTLE_TASK)
+    logger.debug(f"Dispatched {SETTLE_TASK}")
+    return True
+
+
+if __name__ == '__main__':
+    logger.info("Dispatcher started")
+    while True:
+        try:
+            dispatched = dispatch_due()
+        except Exception as e:
+            logger.error(f"Dispatcher error: {e}", exc_info=True)
+            dispatched = 0
+        try:
+            maybe_dispatch_settle()
+        except Exception as e:
+            logger.error(f"Failed to dispatch {SETTLE_TASK}: {e}", exc_info=True)
+        # Полная пачка — вероятно, есть ещё наступившие элементы
+        if dispatched < settings.DISPATCHER_BATCH_SIZE:
+            time.sleep(settings.DISPATCHER_INTERVAL_SECONDS)
@@ -0,0 +1,65 @@
+"""Общий HTTP-клиент для вызовов API бота из задач Celery.
+
+Одна ``requests.Session`` на процесс: соединения к боту переиспользуются
+(keep-alive), а не открываются заново в каждой задаче. После fork
+(prefork-пул Celery) дочерний процесс создаёт свою сессию — сокеты
+родителя не разделяются.
+
+В пулах gevent/eventlet Celery патчит сокеты, и та же сессия работает
+кооперативно; ``BOT_HTTP_POOL_SIZE`` тогда стоит выставить не меньше
+concurrency воркера. Пул блокирующий: при нехватке соединений задача
+ждёт свободное, а не открывает лишнее.
+"""
+import os
+import threading
+
+import requests
+from celery.signals import worker_process_shutdown
+from requests.adapters import HTTPAdapter
+
+from app.config import settings
+
+_session: requests.Session | None = None
+_session_pid: int | None = None
+_lock = threading.Lock()
+
+
+def _create_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.BOT_HTTP_POOL_SIZE,
+        pool_block=True,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """Сессия текущего процесса (создаётся при первом обращении)."""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                _session = _create_session()
+                _session_pid = pid
+    return _session
+
+
+def post_to_bot(path: str, payload: dict, read_timeout: float | None = None) -> requests.Response:
+    """POST в API бота (``BOT_BASE_URL`` + path); ошибки HTTP пробрасываются."""
+    url = settings.BOT_BASE_URL.rstrip("/") + path
+    timeout = (settings.BOT_HTTP_CONNECT_TIMEOUT, read_timeout or settings.BOT_HTTP_READ_TIMEOUT)
+    resp = get_session().post(url, json=payload, timeout=timeout)
+    resp.raise_for_status()
+    return resp
+
+
+@worker_process_shutdown.connect
+def _close_session(**kwargs):
+    global _session
+    if _session is not None and _session_pid == os.getpid():
+        _session.close()
+        _session = None
@@ -1,20 +1,31 @@
-import requests
 import logging
+import redis
+from datetime import timedelta
 from celery_app import celery
+from app.config import settings
 from app.db import SessionLocal
-from app import crud
+from app import crud, due_queue, lessons_view_cache, notify_stream
+from http_client import post_to_bot
 
 # Получаем logger для задач
 logger = logging.getLogger('celery_worker')
 
+r = redis.Redis.from_url(settings.REDIS_URL)
+
+
+def _use_stream() -> bool:
+    return settings.NOTIFY_TRANSPORT == "stream"
+
 
 def send_admin_notification(message: str):
-    """Отправить уведомление админу через bot API"""
+    """Отправить уведомление админу через бота (поток уведомлений или bot API)"""
     try:
         logger.debug("Sending admin notification")
-        url = "http://bot:8080/admin_notify"
-        resp = requests.post(url, json={"message": message}, timeout=10)
-        resp.raise_for_status()
+        if _use_stream():
+            notify_stream.publish_admin(r, message, maxlen=settings.NOTIFY_STREAM_MAXLEN)
+            logger.info("Admin notification queued to notify stream")
+            return True
+        post_to_bot("/admin_notify", {"message": message})
         logger.info("Admin notification sent successfully")
         return True
     except Exception as e:
@@ -23,83 +34,177 @@ def send_admin_notification(message: str):
         return False
 
 
-@celery.task(bind=True, name='tasks.send_notify')
-def send_notify(self, lesson_id: int):
-    """Call bot service HTTP endpoint to notify users about lesson_id"""
-    logger.info(f"Starting notification task for lesson_id={lesson_id}")
-    url = "http://bot:8080/notify"
+def _deliver_lessons(task, lesson_ids: list[int]):
+    """Передать боту напоминания об уроках: записью в поток или HTTP-запросом."""
     try:
-        resp = requests.post(url, json={"lesson_id": lesson_id}, timeout=10)
-        resp.raise_for_status()
-        result = resp.json()
-        logger.info(f"Notification sent for lesson_id={lesson_id}: {result}")
+        if _use_stream():
+            entry_id = notify_stream.publish_lessons(r, lesson_ids, maxlen=settings.NOTIFY_STREAM_MAXLEN)
+            logger.info(f"Notification for lesson_ids={lesson_ids} queued to notify stream ({entry_id})")
+            return True
+        result = post_to_bot("/notify_batch", {"lesson_ids": lesson_ids}).json()
+        logger.info(f"Notification sent for lesson_ids={lesson_ids}: {result}")
         return True
     except Exception as e:
-        logger.error(f"Failed to send notification for lesson_id={lesson_id}: {e}", exc_info=True)
+        logger.error(f"Failed to send notification for lesson_ids={lesson_ids}: {e}", exc_info=True)
+        raise task.retry(exc=e, countdown=60)
+
+
+def _consume_versions(kind: str, items) -> None:
+    """Удалить поля версий выполненных задач; ошибка Redis не делает задачу неуспешной."""
+    try:
+        due_queue.consume_versions(r, kind, items)
+    except Exception as e:
+        logger.warning(f"Failed to clear schedule versions for {kind} {items}: {e}")
+
+
+@celery.task(bind=True, name='tasks.send_notify')
+def send_notify(self, lesson_id: int, version: int | None = None):
+    """Notify linked users and the admin about lesson_id"""
+    logger.info(f"Starting notification task for lesson_id={lesson_id} (version {version})")
+    if not due_queue.is_current_version(r, "notify", lesson_id, version):
+        logger.info(f"Skipping stale notification for lesson_id={lesson_id} (version {version})")
+        return False
+    delivered = _deliver_lessons(self, [lesson_id])
+    _consume_versions("notify", [(lesson_id, version)])
+    return delivered
+
+
+@celery.task(bind=True, name='tasks.send_notify_batch')
+def send_notify_batch(self, items: list):
+    """Notify about several lessons due in the same window with one bot delivery.
+
+    items: [[lesson_id, version], ...]; stale versions are dropped.
+    """
+    current = due_queue.current_versions(r, "notify", [tuple(item) for item in items])
+    if len(current) < len(items):
+        logger.info(f"Skipping {len(items) - len(current)} stale notification(s) in batch")
+    if not current:
+        return False
+    lesson_ids = [lesson_id for lesson_id, _ in current]
+    logger.info(f"Starting batch notification task for lesson_ids={lesson_ids}")
+    delivered = _deliver_lessons(self, lesson_ids)
+    _consume_versions("notify", current)
+    return delivered
+
+
+def _exhausted_message(exhausted: list[tuple[str, list[str]]]) -> str:
+    """Одна сводка администратору по всем ученикам без оплаченных занятий."""
+    lines = ["⚠️ Внимание!", "", "Закончились оплаченные занятия:"]
+    for student_name, lessons in exhausted:
+        titles = ", ".join(f"'{title}'" for title in lessons)
+        lines.append(f"• {student_name} — не списано за: {titles}")
+    lines += [
+        "",
+        "Уроки завершились и отмечены как оплаченные.",
+        "Рекомендуется пополнить баланс учеников через /payment",
+    ]
+    return "\n".join(lines)
+
+
+def _settle(lesson_ids=None) -> dict:
+    """Списать занятия за завершённые уроки и сообщить о результате."""
+    db = SessionLocal()
+    try:
+        result = crud.settle_completed_lessons(
+            db,
+            lookback=timedelta(hours=settings.SETTLE_LOOKBACK_HOURS),
+            limit=settings.SETTLE_BATCH_SIZE,
+            lesson_ids=lesson_ids,
+        )
+    finally:
+        db.close()
+    if not result.lesson_ids:
+        return {"success": True, "settled": 0}
+
+    # Уроки завершились и оплачены: версии их напоминаний и списаний больше не нужны
+    try:
+        due_queue.forget_lessons(r, result.lesson_ids)
+    except Exception as e:
+        logger.warning(f"Failed to clear schedule versions for lessons {result.lesson_ids}: {e}")
+
+    logger.info(
+        f"Settled {len(result.lesson_ids)} completed lesson(s) {result.lesson_ids}, deducted per student: {result.deducted}"
+    )
+    # Уроки стали оплаченными, остатки занятий изменились — кэш /lessons устарел
+    lessons_view_cache.invalidate(r, result.student_ids)
+    admin_notified = False
+    if result.exhausted:
+        logger.warning(f"No paid lessons left for: {[name for name, _ in result.exhausted]}")
+        admin_notified = send_admin_notification(_exhausted_message(result.exhausted))
+    return {
+        "success": True,
+        "settled": len(result.lesson_ids),
+        "deducted": sum(result.deducted.values()),
+        "exhausted": [name for name, _ in result.exhausted],
+        "admin_notified": admin_notified,
+    }
+
+
+_OVERDUE_REPORT_KEY = "settle:overdue_reported"
+
+
+def _report_overdue() -> int:
+    """Сообщить админу о неоплаченных уроках старше окна списания (не чаще SETTLE_OVERDUE_REPORT_SECONDS)."""
+    lookback_hours = settings.SETTLE_LOOKBACK_HOURS
+    db = SessionLocal()
+    try:
+        count, titles = crud.find_overdue_unpaid_lessons(db, lookback=timedelta(hours=lookback_hours))
+    finally:
+        db.close()
+    if not count:
+        return 0
+    if not r.set(_OVERDUE_REPORT_KEY, 1, nx=True, ex=max(int(settings.SETTLE_OVERDUE_REPORT_SECONDS), 1)):
+        return count
+    logger.warning(f"{count} unpaid lesson(s) ended more than {lookback_hours}h ago and will not be settled: {titles}")
+    lines = [
+        "⚠️ Внимание!",
+        "",
+        f"Не списано за {count} урок(ов), завершившихся более {lookback_hours} ч назад — "
+        "автоматическое списание их уже не возьмёт:",
+    ]
+    lines += [f"• '{title}'" for title in titles]
+    if count > len(titles):
+        lines.append(f"• … и ещё {count - len(titles)}")
+    lines += ["", "Проверьте балансы учеников через /payment"]
+    send_admin_notification("\n".join(lines))
+    return count
+
+
+@celery.task(bind=True, name='tasks.settle_completed_lessons')
+def settle_completed_lessons(self):
+    """Periodic sweep: mark ended unpaid lessons paid and deduct balances in one transaction.
+
+    Safe to run concurrently or repeatedly: rows are taken FOR UPDATE SKIP LOCKED
+    and only unpaid lessons are selected. Unpaid lessons older than the lookback
+    window are reported to the admin instead of being charged.
+    """
+    try:
+        result = _settle()
+    except Exception as e:
+        logger.error(f"Error in settle task: {e}", exc_info=True)
         raise self.retry(exc=e, countdown=60)
+    try:
+        result["overdue"] = _report_overdue()
+    except Exception as e:
+        logger.warning(f"Failed to check overdue unpaid lessons: {e}")
+    return result
 
 
 @celery.task(bind=True, name='tasks.deduct_lesson_after_completion')
-def deduct_lesson_after_completion(self, lesson_id: int):
-    """Списать одно оплаченное занятие после завершения урока и отметить урок как оплаченный"""
-    logger.info(f"Starting deduction task for lesson_id={lesson_id}")
-    db = SessionLocal()
+def deduct_lesson_after_completion(self, lesson_id: int, version: int | None = None):
+    """Списать занятие за один завершённый урок.
+
+    Оставлена для элементов ``deduct``, поставленных в очередь до перехода на
+    ``tasks.settle_completed_lessons``; повторный запуск ничего не списывает.
+    """
+    logger.info(f"Starting deduction task for lesson_id={lesson_id} (version {version})")
+    if not due_queue.is_current_version(r, "deduct", lesson_id, version):
+        logger.info(f"Skipping stale deduction for lesson_id={lesson_id} (version {version})")
+        return {"success": False, "error": "stale schedule version"}
     try:
-        lesson = crud.get_lesson(db, lesson_id)
-        if not lesson:
-            logger.warning(f"Lesson not found: lesson_id={lesson_id}")
-            return {"success": False, "error": "lesson not found"}
-        
-        logger.info(f"Processing lesson completion: {lesson.summary} for student_id={lesson.student_id}")
-        
-        # Отмечаем урок как оплаченный
-        paid_lesson = crud.mark_lesson_paid(db, lesson_id, is_paid=True)
-        
-        # Списываем оплаченное занятие у ученика
-        student = crud.deduct_paid_lesson(db, lesson.student_id)
-        
-        if student and paid_lesson:
-            logger.info(f"Successfully deducted lesson for student_id={lesson.student_id}, remaining={student.paid_lessons_count}")
-            return {
-                "success": True, 
-                "student_id": lesson.student_id,
-                "remaining_lessons": student.paid_lessons_count,
-                "lesson_marked_paid": True
-            }
-        elif paid_lesson and not student:
-            # Отправляем уведомление админу о том, что у ученика закончились оплаченные занятия
-            student_info = crud.get_student_by_id(db, lesson.student_id)
-            student_name = student_info.summary if student_info else "Неизвестный ученик"
-            
-            logger.warning(f"No paid lessons to deduct for student {student_name} (student_id={lesson.student_id})")
-            
-            warning_message = (
-                f"⚠️ Внимание!\n\n"
-                f"У ученика {student_name} закончились оплаченные занятия.\n"
-                f"Урок '{lesson.summary}' завершился, но списать занятие не удалось.\n"
-                f"Урок отмечен как оплаченный.\n\n"
-                f"Рекомендуется пополнить баланс ученика через /payment"
-            )
-            
-            send_admin_notification(warning_message)
-            logger.info(f"Admin notification sent for student {student_name}")
-            
-            return {
-                "success": True,
-                "student_id": lesson.student_id, 
-                "remaining_lessons": 0,
-                "lesson_marked_paid": True,
-                "warning": "no paid lessons to deduct, but lesson marked as paid",
-                "admin_notified": True
-            }
-        else:
-            logger.error(f"Failed to process lesson completion for lesson_id={lesson_id}")
-            return {
-                "success": False, 
-                "error": "failed to mark lesson as paid or student not found"
-            }
+        result = _settle([lesson_id])
     except Exception as e:
         logger.error(f"Error in deduction task for lesson_id={lesson_id}: {e}", exc_info=True)
         raise self.retry(exc=e, countdown=60)
-    finally:
-        db.close()
+    _consume_versions("deduct", [(lesson_id, version)])
+    return result
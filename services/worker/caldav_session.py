@@ -0,0 +1,124 @@
+"""Долгоживущее подключение к CalDAV для worker.
+
+Один ``caldav.DAVClient`` (и его ``requests.Session`` с keep-alive) живёт
+между циклами опроса. URL принципала и календаря находятся один раз и
+переиспользуются; повторное обнаружение выполняется только после ошибки
+авторизации или 404.
+"""
+from __future__ import annotations
+
+import logging
+from typing import Callable, TypeVar
+
+import caldav
+import requests
+from caldav.lib import error
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('worker')
+
+T = TypeVar("T")
+
+
+class CalDAVSession:
+    """Подключение к одному календарю одного аккаунта CalDAV."""
+
+    def __init__(
+        self,
+        url: str,
+        username: str,
+        password: str,
+        calendar_name: str,
+        pool_size: int = 4,
+        timeout: int | None = None,
+    ):
+        self.url = url
+        self.username = username
+        self._password = password
+        self.calendar_name = calendar_name
+        self._pool_size = pool_size
+        self._timeout = timeout
+        self._client: caldav.DAVClient | None = None
+        self._adapter: HTTPAdapter | None = None
+        self._principal_url = None
+        self._calendar_url = None
+        # Счётчики закрытых пулов (urllib3 теряет их при пересоздании клиента)
+        self._closed_requests = 0
+        self._closed_connections = 0
+
+    @property
+    def client(self) -> caldav.DAVClient:
+        if self._client is None:
+            logger.debug(f"Connecting to CalDAV server for user: {self.username}")
+            client = caldav.DAVClient(
+                url=self.url,
+                username=self.username,
+                password=self._password,
+                timeout=self._timeout,
+            )
+            if isinstance(client.session, requests.Session):
+                self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+                client.session.mount("https://", self._adapter)
+                client.session.mount("http://", self._adapter)
+            self._client = client
+        return self._client
+
+    def _discover(self) -> None:
+        if self._principal_url is None:
+            principal = self.client.principal()
+            self._principal_url = principal.url
+            logger.info(f"Successfully connected to CalDAV for user: {self.username}")
+        else:
+            principal = caldav.Principal(client=self.client, url=self._principal_url)
+        self._calendar_url = principal.calendar(name=self.calendar_name).url
+        logger.info(f"Resolved calendar '{self.calendar_name}' at {self._calendar_url}")
+
+    def calendar(self) -> caldav.Calendar:
+        """Календарь по закэшированному URL (без обращения к серверу)."""
+        if self._calendar_url is None:
+            self._discover()
+        return caldav.Calendar(client=self.client, url=self._calendar_url)
+
+    def invalidate(self, reconnect: bool = False) -> None:
+        """Сбросить закэшированные URL; с ``reconnect`` — и само подключение."""
+        self._calendar_url = None
+        if reconnect:
+            self._principal_url = None
+            self.close()
+
+    def run(self, action: Callable[[caldav.Calendar], T]) -> T:
+        """Выполнить ``action(calendar)``; после 401/404 — переобнаружить и повторить один раз."""
+        try:
+            return action(self.calendar())
+        except error.AuthorizationError as e:
+            logger.warning(f"CalDAV authorization error for {self.username}, reconnecting: {e}")
+            self.invalidate(reconnect=True)
+        except error.NotFoundError as e:
+            logger.warning(f"CalDAV calendar not found at cached URL, rediscovering: {e}")
+            self.invalidate()
+        return action(self.calendar())
+
+    def close(self) -> None:
+        if self._client is not None:
+            stats = self.connection_stats()
+            self._closed_requests = stats["requests"]
+            self._closed_connections = stats["connections"]
+            self._client.close()
+            self._client = None
+            self._adapter = None
+
+    def connection_stats(self) -> dict[str, int]:
+        """Сколько HTTP-запросов сделано и сколько из них пошло по уже открытому соединению."""
+        requests_total = self._closed_requests
+        connections = self._closed_connections
+        if self._adapter is not None:
+            pools = self._adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                requests_total += pool.num_requests
+                connections += pool.num_connections
+        return {
+            "requests": requests_total,
+            "connections": connections,
+            "reused": requests_total - connections,
+        }
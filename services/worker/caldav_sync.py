@@ -0,0 +1,183 @@
+"""Инкрементальная синхронизация календаря CalDAV.
+
+Снимок календаря (href -> ETag, iCalendar) хранится в памяти процесса и
+дублируется в Redis, чтобы переживать перезапуски. Каждый цикл начинается с
+PROPFIND getctag: если CTag не изменился, сервер больше не опрашивается.
+Иначе выполняется REPORT sync-collection (RFC 6578) по сохранённому
+sync-token, и через calendar-multiget загружаются только изменённые объекты.
+"""
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass, field
+
+from caldav.elements import dav
+from caldav.elements.base import ValuedBaseElement
+from caldav.lib import error
+
+logger = logging.getLogger('worker')
+
+
+# REPORT sync-collection без токена с таким статусом: сервер его не поддерживает
+_REFUSED_STATUSES = (403, 405, 501)
+# С сохранённым токеном: токен устарел (RFC 6578, DAV:valid-sync-token)
+_INVALID_TOKEN_STATUSES = (403, 409)
+
+
+class SyncNotSupported(Exception):
+    """Сервер не поддерживает REPORT sync-collection."""
+
+
+def _http_status(e: error.DAVError) -> int | None:
+    """HTTP-статус из ошибки caldav (текст ответа начинается с кода)."""
+    for text in (e.url, e.reason):
+        head = str(text or "").split(" ", 1)[0]
+        if head.isdigit():
+            return int(head)
+    return None
+
+
+class GetCTag(ValuedBaseElement):
+    """Свойство getctag из пространства имён CalendarServer."""
+
+    tag = "{http://calendarserver.org/ns/}getctag"
+
+
+@dataclass
+class SyncResult:
+    """Итог одной синхронизации календаря."""
+
+    objects: dict[str, tuple[str, str]]
+    changed: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
+    ctag_unchanged: bool = False
+
+
+class IncrementalCalendarSync:
+    """Снимок одного календаря, обновляемый по CTag / sync-token / ETag."""
+
+    def __init__(self, redis_client, calendar_url: str):
+        self._r = redis_client
+        prefix = f"caldav:{calendar_url}"
+        self._state_key = f"{prefix}:state"
+        self._etags_key = f"{prefix}:etags"
+        self._data_key = f"{prefix}:data"
+        self._objects: dict[str, tuple[str, str]] | None = None
+        self._ctag: str | None = None
+        self._sync_token: str | None = None
+        # Сбрасывается, если сервер явно отказал в sync-collection
+        self.supported = True
+
+    def _load_snapshot(self) -> None:
+        """Поднять снимок из Redis (один раз за время жизни процесса)."""
+        state = self._r.hgetall(self._state_key)
+        etags = self._r.hgetall(self._etags_key)
+        data = self._r.hgetall(self._data_key)
+        objects = {}
+        for href, etag in etags.items():
+            ical = data.get(href)
+            if ical is None:
+                continue
+            objects[href.decode()] = (etag.decode(), ical.decode())
+        self._objects = objects
+        self._ctag = state.get(b'ctag', b'').decode() or None
+        self._sync_token = state.get(b'sync_token', b'').decode() or None
+        logger.info("Loaded calendar snapshot from Redis: %s objects", len(objects))
+
+    def _save(self, changed: dict[str, tuple[str, str]], deleted: list[str]) -> None:
+        pipe = self._r.pipeline(transaction=True)
+        if deleted:
+            pipe.hdel(self._etags_key, *deleted)
+            pipe.hdel(self._data_key, *deleted)
+        if changed:
+            pipe.hset(self._etags_key, mapping={href: etag for href, (etag, _) in changed.items()})
+            pipe.hset(self._data_key, mapping={href: ical for href, (_, ical) in changed.items()})
+        pipe.hset(self._state_key, mapping={"ctag": self._ctag or "", "sync_token": self._sync_token or ""})
+        pipe.execute()
+
+    @staticmethod
+    def _report(cal, sync_token):
+        """REPORT sync-collection; ``SyncNotSupported``, если сервер его не поддерживает."""
+        try:
+            report = cal.objects_by_sync_token(sync_token=sync_token, load_objects=False)
+        except error.ReportError as e:
+            if sync_token is None and _http_status(e) in _REFUSED_STATUSES:
+                raise SyncNotSupported(str(e)) from e
+            raise
+        except IndexError as e:
+            # caldav не нашёл sync-token в ответе
+            raise SyncNotSupported("no sync-token in sync-collection response") from e
+        if not report.sync_token:
+            raise SyncNotSupported("no sync-token in sync-collection response")
+        return report
+
+    def reset(self) -> None:
+        """Забыть sync-token и CTag; следующий sync() сделает полную выборку."""
+        self._ctag = None
+        self._sync_token = None
+
+    def sync(self, cal) -> SyncResult:
+        """Синхронизировать снимок с сервером и вернуть все известные объекты."""
+        if self._objects is None:
+            self._load_snapshot()
+
+        ctag = cal.get_property(GetCTag())
+        if ctag and ctag == self._ctag and self._sync_token:
+            logger.debug("CTag unchanged (%s), skipping sync-collection", ctag)
+            return SyncResult(objects=self._objects, ctag_unchanged=True)
+
+        full = self._sync_token is None
+        try:
+            report = self._report(cal, self._sync_token)
+        except error.ReportError as e:
+            # Ошибки авторизации, 404 и 5xx пробрасываются (CalDAVSession.run, backoff)
+            if full or _http_status(e) not in _INVALID_TOKEN_STATUSES:
+                raise
+            logger.warning("Stored sync-token rejected (%s); doing full resync", e)
+            full = True
+            report = self._report(cal, None)
+
+        changed_hrefs: dict[str, str] = {}
+        deleted: list[str] = []
+        seen: set[str] = set()
+        for obj in report:
+            href = str(obj.url.canonical())
+            seen.add(href)
+            etag = obj.props.get(dav.GetEtag.tag)
+            if not etag:
+                # В ответе sync-collection удалённые объекты приходят с 404 и без ETag
+                if href in self._objects:
+                    deleted.append(href)
+                continue
+            known = self._objects.get(href)
+            if known and known[0] == etag:
+                continue
+            changed_hrefs[href] = etag
+
+        if full:
+            deleted.extend(href for href in self._objects if href not in seen)
+
+        changed: dict[str, tuple[str, str]] = {}
+        if changed_hrefs:
+            for loaded in cal.multiget([cal.url.join(href) for href in changed_hrefs]):
+                href = str(loaded.url.canonical())
+                if href in changed_hrefs:
+                    changed[href] = (changed_hrefs[href], loaded.data)
+            # То, что не вернул multiget, успели удалить между REPORT-ами
+            deleted.extend(href for href in changed_hrefs if href not in changed and href in self._objects)
+
+        for href in deleted:
+            self._objects.pop(href, None)
+        self._objects.update(changed)
+        self._ctag = ctag
+        self._sync_token = report.sync_token
+        self._save(changed, deleted)
+
+        logger.info(
+            "Calendar sync (%s): %s changed, %s deleted, %s total",
+            "full" if full else "incremental",
+            len(changed),
+            len(deleted),
+            len(self._objects),
+        )
+        return SyncResult(objects=self._objects, changed=list(changed), deleted=deleted)
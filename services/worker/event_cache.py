@@ -0,0 +1,208 @@
+"""Кэш разобранных событий календаря.
+
+``Calendar.from_ical`` — самая дорогая часть цикла worker, поэтому результат
+разбора (компактный ``EventSpec`` на каждый VEVENT) кэшируется по ключу
+href+ETag или по хэшу содержимого. Кэш — LRU в памяти процесса, при
+желании продублированный в Redis, чтобы пережить перезапуск.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+logger = logging.getLogger('worker')
+
+
+@dataclass(frozen=True)
+class RecurrenceSpec:
+    """Параметры RRULE, которые умеет разворачивать worker."""
+
+    freq: str | None
+    interval: int = 1
+    byday: tuple[str, ...] = ()
+    until: datetime | None = None
+    count: int | None = None
+
+
+@dataclass(frozen=True)
+class EventSpec:
+    """Нормализованный VEVENT: всё, что нужно для развёртки повторений."""
+
+    uid: str
+    summary: str
+    start: datetime
+    end: datetime
+    rrule: RecurrenceSpec | None = None
+
+    @property
+    def duration(self) -> timedelta:
+        return self.end - self.start
+
+
+def event_span(specs: list[EventSpec]) -> tuple[datetime, datetime | None] | None:
+    """Интервал, в который попадают все повторения событий: (начало, конец).
+
+    Конец None — повторения без ограничения; None вместо интервала — событий нет.
+    Граница для COUNT оценивается сверху (одно повторение в неделю интервала).
+    """
+    span = None
+    for spec in specs:
+        rule = spec.rrule
+        if rule is None or rule.freq != 'WEEKLY':
+            end = spec.end
+        elif rule.until is not None:
+            end = max(rule.until + spec.duration, spec.end)
+        elif rule.count:
+            end = spec.start + timedelta(weeks=rule.interval * rule.count) + spec.duration
+        else:
+            end = None
+        if span is None:
+            span = (spec.start, end)
+        else:
+            span = (min(span[0], spec.start), None if span[1] is None or end is None else max(span[1], end))
+    return span
+
+
+def _zone_key(value: datetime) -> str | None:
+    """Имя зоны IANA, если его можно восстановить через ``zoneinfo``."""
+    key = getattr(value.tzinfo, 'key', None) or getattr(value.tzinfo, 'zone', None)
+    if not key:
+        return None
+    try:
+        ZoneInfo(key)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+    return key
+
+
+def _dt_to_json(value: datetime | None):
+    if value is None:
+        return None
+    key = _zone_key(value)
+    if key:
+        # Сохраняем локальное время и зону, чтобы недельные повторения корректно проходили через DST
+        return [value.replace(tzinfo=None).isoformat(), key]
+    return [value.isoformat(), None]
+
+
+def _dt_from_json(data) -> datetime | None:
+    if data is None:
+        return None
+    iso, key = data
+    value = datetime.fromisoformat(iso)
+    return value.replace(tzinfo=ZoneInfo(key)) if key else value
+
+
+def _spec_to_json(spec: EventSpec) -> dict:
+    rule = None
+    if spec.rrule is not None:
+        rule = {
+            "freq": spec.rrule.freq,
+            "interval": spec.rrule.interval,
+            "byday": list(spec.rrule.byday),
+            "until": _dt_to_json(spec.rrule.until),
+            "count": spec.rrule.count,
+        }
+    return {
+        "uid": spec.uid,
+        "summary": spec.summary,
+        "start": _dt_to_json(spec.start),
+        "end": _dt_to_json(spec.end),
+        "rrule": rule,
+    }
+
+
+def _spec_from_json(data: dict) -> EventSpec:
+    rule = data.get("rrule")
+    return EventSpec(
+        uid=data["uid"],
+        summary=data["summary"],
+        start=_dt_from_json(data["start"]),
+        end=_dt_from_json(data["end"]),
+        rrule=None if rule is None else RecurrenceSpec(
+            freq=rule["freq"],
+            interval=rule["interval"],
+            byday=tuple(rule["byday"]),
+            until=_dt_from_json(rule["until"]),
+            count=rule["count"],
+        ),
+    )
+
+
+def content_key(ical: str | bytes) -> str:
+    """Ключ кэша по содержимому — для объектов без href/ETag."""
+    if isinstance(ical, str):
+        ical = ical.encode()
+    return "sha1:" + hashlib.sha1(ical).hexdigest()
+
+
+class ParsedEventCache:
+    """LRU-кэш ``key -> list[EventSpec]`` с необязательным слоем в Redis.
+
+    Потокобезопасен: им одновременно пользуются опросы разных календарей.
+    """
+
+    def __init__(self, maxsize: int = 2048, redis_client=None, redis_ttl: int = 7 * 24 * 3600):
+        self._maxsize = maxsize
+        self._entries: OrderedDict[str, list[EventSpec]] = OrderedDict()
+        self._r = redis_client
+        self._redis_ttl = redis_ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def _redis_key(self, key: str) -> str:
+        return "evcache:" + hashlib.sha1(key.encode()).hexdigest()
+
+    def _remember(self, key: str, specs: list[EventSpec]) -> None:
+        with self._lock:
+            self._entries[key] = specs
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str) -> list[EventSpec] | None:
+        with self._lock:
+            specs = self._entries.get(key)
+            if specs is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return specs
+        if self._r is not None:
+            try:
+                raw = self._r.get(self._redis_key(key))
+                if raw is not None:
+                    specs = [_spec_from_json(item) for item in json.loads(raw)]
+                    self._remember(key, specs)
+                    with self._lock:
+                        self.redis_hits += 1
+                    return specs
+            except Exception as e:  # noqa: BLE001
+                logger.warning(f"Failed to read parsed event from Redis cache: {e}")
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, specs: list[EventSpec]) -> None:
+        self._remember(key, specs)
+        if self._r is not None:
+            try:
+                payload = json.dumps([_spec_to_json(spec) for spec in specs])
+                self._r.set(self._redis_key(key), payload, ex=self._redis_ttl)
+            except Exception as e:  # noqa: BLE001
+                logger.warning(f"Failed to store parsed event in Redis cache: {e}")
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+        }
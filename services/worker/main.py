@@ -1,10 +1,11 @@
 import logging
+import threading
 import time
 from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 import hashlib
 import redis
 from icalendar import Calendar
-import caldav
 from dateutil.rrule import (
     WEEKLY,
     MO,
@@ -19,113 +20,83 @@ from dateutil.rrule import (
 )
 
 from app.config import settings
-from app.db import SessionLocal, engine
-from app import models, crud
+from app.db import SessionLocal
+from app import crud, due_queue, lessons_view_cache, migrate
 from app.logging_config import setup_root_logging
-from celery import Celery
+from app.sync_trigger import SYNC_NOW_CHANNEL
+
+from caldav_session import CalDAVSession
+from caldav_sync import IncrementalCalendarSync, SyncNotSupported
+from event_cache import EventSpec, ParsedEventCache, RecurrenceSpec, content_key, event_span
+from poll_schedule import PollPolicy, parse_quiet_hours
+from poller import CalendarSource, PollResult, PollScheduler
 
 # Настраиваем логирование для worker
 logger = setup_root_logging('worker', log_level=logging.INFO)
 
-# create local celery instance for the worker to submit tasks
-celery = Celery('worker_sender', broker=settings.REDIS_URL, backend=settings.REDIS_URL)
-celery.conf.accept_content = ['json']
-celery.conf.result_serializer = 'json'
-celery.conf.task_serializer = 'json'
-
-# create tables
-models.Base.metadata.create_all(bind=engine)
+# Схема БД: миграции Alembic (app/migrations)
+migrate.upgrade()
 
 r = redis.Redis.from_url(settings.REDIS_URL)
 
-WEBSITE = settings.CALDAV_WEBSITE
-EMAIL = settings.CALDAV_EMAIL
-PASSWORD = settings.CALDAV_PASSWORD
+event_cache = ParsedEventCache(
+    maxsize=settings.WORKER_EVENT_CACHE_SIZE,
+    redis_client=r if settings.WORKER_EVENT_CACHE_REDIS else None,
+)
 
+# Снимки календарей для инкрементальной синхронизации (ключ — URL календаря)
+_calendar_syncs: dict[str, IncrementalCalendarSync] = {}
+# Интервалы дат объектов снимка: URL календаря -> {ключ кэша: event_span}
+_snapshot_spans: dict[str, dict[str, tuple | None]] = {}
 
-def get_principal(username, leg_token):
-    try:
-        logger.debug(f"Connecting to CalDAV server for user: {username}")
-        client = caldav.DAVClient(url=WEBSITE, username=username, password=leg_token)
-        principal = client.principal()
-        logger.info(f"Successfully connected to CalDAV for user: {username}")
-        return principal
-    except Exception as e:
-        logger.error(f"Error getting principal for {username}: {e}", exc_info=True)
-        raise
-
-
-def schedule_lesson(db, event_uid, summary, start_dt, end_dt):
-    logger.debug(f"Scheduling lesson: {summary} (UID: {event_uid}), Start: {start_dt}, End: {end_dt}")
-    student = crud.get_or_create_student(db, summary)
-    lesson, changed = crud.upsert_lesson(db, event_uid=event_uid, summary=summary, start=start_dt, end=end_dt, student=student)
-
-    if changed:
-        logger.info(f"Lesson updated: {summary} for student {student.summary} (ID: {lesson.id})")
-    
-    notify_time = start_dt - timedelta(minutes=30)
-    deduct_time = end_dt  # Списание после окончания урока
+
+def schedule_lessons(lessons):
+    """Put notification items for changed lessons into the due queue.
+
+    lessons: list of (lesson_id, event_uid, summary, start, end).
+    All ``scheduled:*`` hashes are read in one pipeline; the queue items and
+    updated hashes are written in another, so Redis round-trips don't grow
+    with the number of lessons. Deductions are not scheduled per lesson: the
+    periodic ``tasks.settle_completed_lessons`` sweep handles ended lessons.
+
+    Returns the number of notifications put into the queue.
+    """
+    if not lessons:
+        return 0
     now = datetime.now(timezone.utc)
-    
-    # Schedule notification (existing logic)
-    if notify_time > now:
-        key = f"scheduled:{event_uid}"
-        existing = r.hgetall(key)
+
+    read = r.pipeline(transaction=False)
+    for _, event_uid, _, _, _ in lessons:
+        read.hgetall(f"scheduled:{event_uid}")
+    existing_hashes = read.execute()
+
+    pending = []
+    for (lesson_id, event_uid, summary, start_dt, end_dt), existing in zip(lessons, existing_hashes):
+        logger.debug(f"Scheduling lesson: {summary} (UID: {event_uid}), Start: {start_dt}, End: {end_dt}")
+        # Округляем вниз до окна группировки, чтобы одновременные уроки ушли одной пачкой
+        notify_time = due_queue.bucket_start(start_dt - timedelta(minutes=30), settings.NOTIFY_BATCH_WINDOW_SECONDS)
+        if notify_time <= now:
+            continue
         start_ts = int(start_dt.timestamp())
-        if existing:
-            old_start = int(existing.get(b'start_ts', b'0'))
-            if old_start == start_ts:
-                # Already scheduled for this start time, skip notification scheduling
-                logger.debug(f"Notification already scheduled for lesson {event_uid}")
-                pass
-            else:
-                # revoke old
-                old_task_id = existing.get(b'task_id')
-                if old_task_id:
-                    try:
-                        celery.control.revoke(old_task_id.decode(), terminate=True)
-                        logger.info(f"Revoked old notification task {old_task_id.decode()} for lesson {event_uid}")
-                    except Exception as e:
-                        logger.warning(f"Failed to revoke old task {old_task_id}: {e}")
-                # schedule new notification
-                eta = notify_time
-                res = celery.send_task('tasks.send_notify', args=[lesson.id], eta=eta)
-                r.hset(key, mapping={"task_id": res.id, "start_ts": start_ts})
-                logger.info(f"Scheduled notification for lesson {event_uid} at {notify_time} (task_id: {res.id})")
-        else:
-            # schedule new notification
-            eta = notify_time
-            res = celery.send_task('tasks.send_notify', args=[lesson.id], eta=eta)
-            r.hset(key, mapping={"task_id": res.id, "start_ts": start_ts})
-            logger.info(f"Scheduled notification for lesson {event_uid} at {notify_time} (task_id: {res.id})")
-
-    # Schedule lesson deduction after completion (new logic)
-    if deduct_time > now:
-        deduct_key = f"deduct:{event_uid}"
-        existing_deduct = r.hgetall(deduct_key)
-        end_ts = int(end_dt.timestamp())
-        
-        if existing_deduct:
-            old_end = int(existing_deduct.get(b'end_ts', b'0'))
-            if old_end == end_ts:
-                # Already scheduled for this end time, skip
-                logger.debug(f"Deduction already scheduled for lesson {event_uid}")
-                return
-            else:
-                # revoke old deduct task
-                old_deduct_task_id = existing_deduct.get(b'deduct_task_id')
-                if old_deduct_task_id:
-                    try:
-                        celery.control.revoke(old_deduct_task_id.decode(), terminate=True)
-                        logger.info(f"Revoked old deduction task {old_deduct_task_id.decode()} for lesson {event_uid}")
-                    except Exception as e:
-                        logger.warning(f"Failed to revoke old deduct task {old_deduct_task_id}: {e}")
-        
-        # schedule new deduct task
-        eta_deduct = deduct_time
-        res_deduct = celery.send_task('tasks.deduct_lesson_after_completion', args=[lesson.id], eta=eta_deduct)
-        r.hset(deduct_key, mapping={"deduct_task_id": res_deduct.id, "end_ts": end_ts})
-        logger.info(f"Scheduled deduction for lesson {event_uid} at {deduct_time} (task_id: {res_deduct.id})")
+        if existing and int(existing.get(b'start_ts', b'0')) == start_ts:
+            # Already scheduled for this start time, skip notification scheduling
+            logger.debug(f"Notification already scheduled for lesson {event_uid}")
+            continue
+        pending.append((lesson_id, event_uid, start_ts, notify_time, existing.get(b'member')))
+    if not pending:
+        return 0
+
+    write = r.pipeline(transaction=True)
+    versions = due_queue.next_versions(r, len(pending))
+    for (lesson_id, event_uid, start_ts, notify_time, old_member), version in zip(pending, versions):
+        member = due_queue.make_member("notify", lesson_id, version)
+        write.hset(due_queue.SCHEDULE_VERSIONS_KEY, due_queue.version_field("notify", lesson_id), version)
+        due_queue.schedule(write, member, notify_time, old_member=old_member)
+        write.delete(f"scheduled:{event_uid}")
+        write.hset(f"scheduled:{event_uid}", mapping={"member": member, "start_ts": start_ts})
+        logger.info(f"Scheduled notification for lesson {event_uid} at {notify_time}")
+    write.execute()
+    return len(pending)
 
 
 ICAL_WEEKDAY_MAP = {
@@ -161,44 +132,75 @@ def _build_occurrence_uid(base_uid: str, occurrence_start: datetime) -> str:
     return f"{base_uid}#{occurrence_date}"
 
 
-def expand_component_occurrences(component, summary: str, window_start: datetime, window_end: datetime):
-    """Expand VEVENT into concrete occurrences within the window."""
+def extract_event_spec(component) -> EventSpec | None:
+    """Normalize VEVENT into a compact EventSpec (what the parsed-event cache stores)."""
+    summary = str(component.get('summary'))
     raw_start = component.get('dtstart')
     if raw_start is None:
         logger.warning("Skipping event without DTSTART: %s", summary)
-        return []
+        return None
 
     base_start = _ensure_datetime(raw_start.dt, None)
     raw_end = component.get('dtend')
 
     if raw_end is None:
-        duration = timedelta(hours=1)
-        base_end = base_start + duration
+        base_end = base_start + timedelta(hours=1)
         logger.debug("Event %s missing DTEND; using fallback duration 1h", summary)
     else:
         base_end = _ensure_datetime(raw_end.dt, base_start.tzinfo)
-        duration = base_end - base_start
 
     raw_uid = component.get('uid')
     base_uid = str(raw_uid) if raw_uid else hashlib.sha1((summary + str(base_start)).encode()).hexdigest()
 
     rrule_field = component.get('rrule')
     if not rrule_field:
-        if base_end < window_start or base_start > window_end:
-            return []
-        return [(_build_occurrence_uid(base_uid, base_start), base_start, base_end)]
+        return EventSpec(uid=base_uid, summary=summary, start=base_start, end=base_end)
 
     freq_values = rrule_field.get('FREQ')
     freq_value = freq_values[0].upper() if freq_values else None
     if freq_value != 'WEEKLY':
-        logger.debug("Unsupported RRULE frequency %s for event %s; using single occurrence", freq_value, summary)
+        rule = RecurrenceSpec(freq=freq_value)
+        return EventSpec(uid=base_uid, summary=summary, start=base_start, end=base_end, rrule=rule)
+
+    until_values = rrule_field.get('UNTIL')
+    until_candidate = None
+    if until_values:
+        raw_until = until_values[0]
+        if hasattr(raw_until, 'dt'):
+            raw_until = raw_until.dt
+        until_candidate = _ensure_datetime(raw_until, base_start.tzinfo)
+
+    count_values = rrule_field.get('COUNT')
+    rule = RecurrenceSpec(
+        freq=freq_value,
+        interval=int(rrule_field.get('INTERVAL', [1])[0]),
+        byday=tuple(str(day) for day in rrule_field.get('BYDAY') or []),
+        until=until_candidate,
+        count=int(count_values[0]) if count_values else None,
+    )
+    return EventSpec(uid=base_uid, summary=summary, start=base_start, end=base_end, rrule=rule)
+
+
+def expand_event_occurrences(spec: EventSpec, window_start: datetime, window_end: datetime):
+    """Expand a normalized event into concrete occurrences within the window."""
+    base_start = spec.start
+    base_end = spec.end
+    base_uid = spec.uid
+    rule = spec.rrule
+
+    if rule is None:
         if base_end < window_start or base_start > window_end:
             return []
         return [(_build_occurrence_uid(base_uid, base_start), base_start, base_end)]
 
-    interval = int(rrule_field.get('INTERVAL', [1])[0])
-    byday_values = rrule_field.get('BYDAY') or []
-    byweekday = tuple(ICAL_WEEKDAY_MAP[day] for day in byday_values if day in ICAL_WEEKDAY_MAP)
+    if rule.freq != 'WEEKLY':
+        logger.debug("Unsupported RRULE frequency %s for event %s; using single occurrence", rule.freq, spec.summary)
+        if base_end < window_start or base_start > window_end:
+            return []
+        return [(_build_occurrence_uid(base_uid, base_start), base_start, base_end)]
+
+    duration = spec.duration
+    byweekday = tuple(ICAL_WEEKDAY_MAP[day] for day in rule.byday if day in ICAL_WEEKDAY_MAP)
     if not byweekday:
         byweekday = (rrule_weekday(base_start.weekday()),)
 
@@ -209,27 +211,18 @@ def expand_component_occurrences(component, summary: str, window_start: datetime
         window_start_local = window_start.replace(tzinfo=None)
         window_end_local = window_end.replace(tzinfo=None)
 
-    until_values = rrule_field.get('UNTIL')
-    until_candidate = None
-    if until_values:
-        raw_until = until_values[0]
-        if hasattr(raw_until, 'dt'):
-            raw_until = raw_until.dt
-        until_candidate = _ensure_datetime(raw_until, base_start.tzinfo)
-
-    count_values = rrule_field.get('COUNT')
     rule_kwargs = {
         'freq': WEEKLY,
         'dtstart': base_start,
-        'interval': interval,
+        'interval': rule.interval,
         'byweekday': byweekday,
     }
-    if count_values:
-        rule_kwargs['count'] = int(count_values[0])
+    if rule.count:
+        rule_kwargs['count'] = rule.count
     else:
         until_limit = window_end_local
-        if until_candidate:
-            until_limit = min(until_candidate, window_end_local)
+        if rule.until:
+            until_limit = min(rule.until, window_end_local)
         rule_kwargs['until'] = until_limit
 
     recurrence = rrule(**rule_kwargs)
@@ -248,36 +241,175 @@ def expand_component_occurrences(component, summary: str, window_start: datetime
     return occurrences
 
 
-def parse_and_schedule():
+def expand_component_occurrences(component, summary: str, window_start: datetime, window_end: datetime):
+    """Expand VEVENT into concrete occurrences within the window."""
+    spec = extract_event_spec(component)
+    if spec is None:
+        return []
+    return expand_event_occurrences(spec, window_start, window_end)
+
+
+def parse_event_specs(cache_key: str, ical) -> list[EventSpec]:
+    """Parse iCalendar object into EventSpecs, reusing the parsed-event cache."""
+    specs = event_cache.get(cache_key)
+    if specs is None:
+        calobj = Calendar.from_ical(ical)
+        specs = []
+        for component in calobj.walk():
+            if component.name == "VEVENT":
+                spec = extract_event_spec(component)
+                if spec is not None:
+                    specs.append(spec)
+        event_cache.put(cache_key, specs)
+    return specs
+
+
+def _objects_in_window(calendar_url: str, objects: dict, start_date, end_date):
+    """Оставить из снимка объекты, повторения которых могут попасть в окно.
+
+    Интервал дат объекта вычисляется один раз (при первом разборе) и
+    хранится по ключу кэша, поэтому объекты вне окна не разбираются и не
+    вытесняют из кэша разобранных событий нужные.
+    """
+    spans = _snapshot_spans.setdefault(calendar_url, {})
+    for key in [key for key in spans if key not in objects]:
+        del spans[key]
+    selected = []
+    for key, ical in objects.items():
+        if key not in spans:
+            spans[key] = event_span(parse_event_specs(key, ical))
+        span = spans[key]
+        if span is not None and span[0] <= end_date and (span[1] is None or span[1] >= start_date):
+            selected.append((key, ical))
+    logger.debug(f"Snapshot: {len(selected)} of {len(objects)} objects overlap the poll window")
+    return selected
+
+
+def fetch_calendar_objects(cal, start_date, end_date):
+    """Вернуть пары (ключ кэша, iCalendar) для разбора в этом цикле.
+
+    В режиме ``incremental`` с сервера подтягиваются только изменения, а
+    остальное берётся из снимка (только объекты, пересекающие окно). Если сервер отказал в sync-collection,
+    используется полный поиск по окну.
+    """
+    if settings.WORKER_SYNC_MODE == "incremental":
+        calendar_url = str(cal.url)
+        syncer = _calendar_syncs.get(calendar_url)
+        if syncer is None:
+            syncer = _calendar_syncs[calendar_url] = IncrementalCalendarSync(r, calendar_url)
+        if syncer.supported:
+            try:
+                result = syncer.sync(cal)
+                objects = {f"{href}|{etag}": ical for href, (etag, ical) in result.objects.items()}
+                return _objects_in_window(calendar_url, objects, start_date, end_date)
+            except SyncNotSupported as e:
+                syncer.supported = False
+                logger.warning(f"Incremental sync is not supported by the server, falling back to search: {e}")
+
+    logger.info(f"Fetching events from {start_date} to {end_date}")
+    return [(content_key(evt.data), evt.data) for evt in cal.search(start=start_date, end=end_date)]
+
+
+def parse_and_schedule(source: CalendarSource) -> PollResult:
+    """Sync one calendar and schedule its lessons for the next 7 days.
+
+    Errors propagate to the PollScheduler, which logs them per calendar and
+    backs off. The returned next lesson start drives the next poll time.
+    """
+    logger.info(f"[{source.name}] Starting calendar parsing and scheduling...")
+    start_date = datetime.now(timezone.utc)
+    end_date = start_date + timedelta(days=7)
+    events = source.session.run(lambda cal: fetch_calendar_objects(cal, start_date, end_date))
+    logger.info(f"[{source.name}] Found {len(events)} events")
+    conn_stats = source.session.connection_stats()
+    logger.info(f"[{source.name}] CalDAV connections: {conn_stats['requests']} requests, {conn_stats['reused']} reused")
+
+    # event_uid -> (event_uid, summary, start, end); при дублях побеждает последнее вхождение
+    occurrences = {}
+    for cache_key, ical in events:
+        for spec in parse_event_specs(cache_key, ical):
+            expanded = expand_event_occurrences(spec, start_date, end_date)
+            if not expanded:
+                logger.debug("No occurrences within window for event %s", spec.summary)
+                continue
+            for occurrence_uid, start, end in expanded:
+                occurrences[occurrence_uid] = (occurrence_uid, spec.summary, start, end)
+
+    db = SessionLocal()
     try:
-        logger.info("Starting calendar parsing and scheduling...")
-        principal = get_principal(EMAIL, PASSWORD)
-        cal = principal.calendar(name="Мои события")
-        start_date = datetime.now(timezone.utc)
-        end_date = start_date + timedelta(days=7)
-        logger.info(f"Fetching events from {start_date} to {end_date}")
-        events = cal.search(start=start_date, end=end_date)
-        logger.info(f"Found {len(events)} events")
-        
-        db = SessionLocal()
-        events_processed = 0
-        for evt in events:
-            calobj = Calendar.from_ical(evt.data)
-            for component in calobj.walk():
-                if component.name == "VEVENT":
-                    summary = str(component.get('summary'))
-                    occurrences = expand_component_occurrences(component, summary, start_date, end_date)
-                    if not occurrences:
-                        logger.debug("No occurrences within window for event %s", summary)
-                        continue
-                    for occurrence_uid, start, end in occurrences:
-                        schedule_lesson(db, occurrence_uid, summary, start, end)
-                        events_processed += 1
-        
-        logger.info(f"Successfully processed {events_processed} events")
+        lesson_ids, changed_ids, changed_student_ids = crud.reconcile_lessons(db, occurrences.values())
+    finally:
         db.close()
-    except Exception as e:
-        logger.error(f"Worker error in parse_and_schedule: {e}", exc_info=True)
+    logger.info(f"[{source.name}] Reconciled {len(lesson_ids)} lessons, {len(changed_ids)} created or updated")
+    if changed_ids:
+        lessons_view_cache.invalidate(r, changed_student_ids)
+
+    scheduled = schedule_lessons([
+        (lesson_ids[occurrence_uid], occurrence_uid, summary, start, end)
+        for occurrence_uid, summary, start, end in occurrences.values()
+        if lesson_ids[occurrence_uid] in changed_ids
+    ])
+
+    logger.info(f"[{source.name}] Successfully processed {len(occurrences)} events")
+    logger.info("Parsed event cache: %(hits)s hits, %(redis_hits)s Redis hits, %(misses)s misses", event_cache.stats())
+
+    now = datetime.now(timezone.utc)
+    upcoming = [start for _, _, start, _ in occurrences.values() if start > now]
+    return PollResult(
+        next_lesson_start=min(upcoming) if upcoming else None,
+        changed_lessons=len(changed_ids),
+        scheduled_items=scheduled,
+    )
+
+
+def build_sources() -> list[CalendarSource]:
+    """One CalendarSource (with its own CalDAV session) per configured calendar."""
+    sources = []
+    quiet_hours = parse_quiet_hours(settings.WORKER_QUIET_HOURS)
+    tz = ZoneInfo(settings.TIMEZONE)
+    for cfg in settings.caldav_calendars():
+        timeout = cfg.timeout_seconds or settings.CALDAV_TIMEOUT_SECONDS
+        session = CalDAVSession(
+            cfg.website,
+            cfg.email,
+            cfg.password,
+            cfg.calendar,
+            pool_size=settings.CALDAV_POOL_SIZE,
+            timeout=timeout,
+        )
+        sources.append(
+            CalendarSource(
+                name=f"{cfg.email}/{cfg.calendar}",
+                session=session,
+                policy=PollPolicy(
+                    base_seconds=cfg.poll_seconds or settings.WORKER_POLL_SECONDS,
+                    min_seconds=settings.WORKER_POLL_MIN_SECONDS,
+                    max_seconds=settings.WORKER_POLL_MAX_SECONDS,
+                    soon_seconds=settings.WORKER_POLL_SOON_SECONDS,
+                    error_base_seconds=settings.WORKER_ERROR_BACKOFF_SECONDS,
+                    quiet_hours=quiet_hours,
+                    tz=tz,
+                ),
+                timeout_seconds=timeout,
+            )
+        )
+    return sources
+
+
+def listen_for_sync_requests(scheduler: PollScheduler) -> None:
+    """Forward "sync now" requests from Redis pub/sub to the scheduler (runs in a thread)."""
+    while True:
+        try:
+            pubsub = r.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(SYNC_NOW_CHANNEL)
+            logger.info(f"Listening for sync requests on {SYNC_NOW_CHANNEL}")
+            for message in pubsub.listen():
+                name = message['data'].decode() or None
+                matched = scheduler.request_sync(name)
+                logger.info(f"Sync requested for {name or 'all calendars'} ({matched} matched)")
+        except Exception as e:
+            logger.warning(f"Sync request listener error: {e}; reconnecting in 5 seconds")
+            time.sleep(5)
 
 
 if __name__ == '__main__':
@@ -289,16 +421,25 @@ if __name__ == '__main__':
 
     logging.getLogger().addFilter(CaldavNoiseFilter())
     
+    sources = build_sources()
+    if not sources:
+        raise SystemExit("No calendars configured: set CALDAV_EMAIL/CALDAV_PASSWORD or CALDAV_ACCOUNTS")
+
     logger.info("=" * 60)
     logger.info("Worker started")
-    logger.info(f"Polling interval: {settings.WORKER_POLL_SECONDS} seconds")
+    for source in sources:
+        logger.info(
+            f"Calendar {source.name}: polling every {source.policy.base_seconds}s "
+            f"({source.policy.min_seconds}s when a lesson is near, up to {source.policy.max_seconds}s when idle)"
+        )
+    logger.info(f"Max concurrent polls: {settings.WORKER_MAX_CONCURRENCY}")
     logger.info("=" * 60)
-    
-    while True:
-        try:
-            logger.info(f'Worker running parse_and_schedule at {datetime.now()}')
-            parse_and_schedule()
-            logger.info(f'Worker completed cycle, sleeping for {settings.WORKER_POLL_SECONDS} seconds')
-        except Exception as e:
-            logger.error(f'Worker error: {e}', exc_info=True)
-        time.sleep(settings.WORKER_POLL_SECONDS)
+
+    scheduler = PollScheduler(
+        sources,
+        parse_and_schedule,
+        max_workers=settings.WORKER_MAX_CONCURRENCY,
+        debounce_seconds=settings.WORKER_SYNC_DEBOUNCE_SECONDS,
+    )
+    threading.Thread(target=listen_for_sync_requests, args=(scheduler,), name="sync-listener", daemon=True).start()
+    scheduler.run_forever()
@@ -0,0 +1,78 @@
+"""Выбор времени следующего опроса календаря.
+
+Вместо фиксированного интервала задержка подбирается по данным:
+- урок скоро (в пределах ``soon_seconds``) — опрашиваем часто, чтобы
+  успеть поймать перенос до напоминания;
+- окно пустое или сейчас «тихие часы» — опрашиваем редко, но просыпаемся
+  к моменту, когда ближайший урок станет «скорым»;
+- после ошибок CalDAV — экспоненциальная задержка со случайным разбросом.
+"""
+from __future__ import annotations
+
+import random
+from dataclasses import dataclass
+from datetime import datetime, timezone, tzinfo
+
+
+@dataclass(frozen=True)
+class PollPolicy:
+    base_seconds: float
+    min_seconds: float
+    max_seconds: float
+    soon_seconds: float
+    error_base_seconds: float
+    quiet_hours: tuple[int, int] | None = None
+    tz: tzinfo = timezone.utc
+
+
+def parse_quiet_hours(value: str) -> tuple[int, int] | None:
+    """``"0-7"`` -> (0, 7); пустая строка отключает тихие часы."""
+    value = value.strip()
+    if not value:
+        return None
+    start, end = (int(part) for part in value.split("-", 1))
+    return start % 24, end % 24
+
+
+def _quiet_seconds_left(now: datetime, policy: PollPolicy) -> float | None:
+    """Сколько секунд осталось до конца тихих часов (None — сейчас не тихие часы)."""
+    if policy.quiet_hours is None:
+        return None
+    start, end = policy.quiet_hours
+    local = now.astimezone(policy.tz)
+    hour = local.hour
+    inside = start <= hour < end if start <= end else (hour >= start or hour < end)
+    if not inside:
+        return None
+    hours_left = (end - hour) % 24
+    return hours_left * 3600 - local.minute * 60 - local.second
+
+
+def next_poll_delay(
+    policy: PollPolicy,
+    now: datetime,
+    next_lesson_start: datetime | None,
+    error_count: int = 0,
+) -> float:
+    """Задержка (сек) до следующего опроса календаря."""
+    if error_count:
+        delay = min(policy.max_seconds, policy.error_base_seconds * 2 ** (error_count - 1))
+        return random.uniform(delay / 2, delay)
+
+    until_soon = None
+    if next_lesson_start is not None:
+        until_soon = (next_lesson_start - now).total_seconds() - policy.soon_seconds
+        if until_soon <= 0:
+            return policy.min_seconds
+
+    quiet_left = _quiet_seconds_left(now, policy)
+    if next_lesson_start is None or quiet_left is not None:
+        delay = policy.max_seconds
+        if quiet_left is not None and next_lesson_start is not None:
+            delay = min(delay, max(quiet_left, policy.base_seconds))
+    else:
+        delay = policy.base_seconds
+
+    if until_soon is not None:
+        delay = min(delay, until_soon)
+    return max(policy.min_seconds, delay)
@@ -0,0 +1,169 @@
+"""Параллельный опрос нескольких календарей CalDAV.
+
+Каждый календарь опрашивается по своему расписанию в общем ограниченном
+пуле потоков; задержка до следующего опроса выбирается
+``poll_schedule.next_poll_delay`` по ближайшему уроку и числу ошибок
+подряд. Внеочередной опрос можно запросить через ``request_sync`` —
+запросы объединяются с задержкой ``debounce_seconds`` и никогда не
+пересекаются с уже идущим опросом того же календаря.
+
+Ошибка или зависание одного календаря не задерживает остальные:
+следующий опрос календаря ставится только после завершения предыдущего,
+а длительность цикла определяется самым медленным календарём, а не
+суммой всех.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable
+
+from caldav_session import CalDAVSession
+from poll_schedule import PollPolicy, next_poll_delay
+
+logger = logging.getLogger('worker')
+
+
+@dataclass(frozen=True)
+class PollResult:
+    """Итог опроса, по которому выбирается время следующего."""
+
+    next_lesson_start: datetime | None = None
+    # Реально изменившиеся уроки и поставленные в очередь напоминания за цикл
+    changed_lessons: int = 0
+    scheduled_items: int = 0
+
+
+@dataclass(eq=False)
+class CalendarSource:
+    """Опрашиваемый календарь и состояние его расписания."""
+
+    name: str
+    session: CalDAVSession
+    policy: PollPolicy
+    timeout_seconds: int
+    next_run: float = 0.0
+    error_count: int = 0
+    result: PollResult | None = None
+    future: Future | None = field(default=None, repr=False)
+    started_at: float = 0.0
+    finished_at: float = 0.0
+    overdue_logged: bool = False
+    # Первый и последний необработанный запрос внеочередной синхронизации
+    sync_first_requested: float | None = None
+    sync_last_requested: float | None = None
+
+
+# Серия запросов синхронизации откладывает опрос не дольше debounce * этот множитель
+_MAX_DEBOUNCE_FACTOR = 4
+
+
+class PollScheduler:
+    """Запускает ``poll_fn(source)`` для каждого календаря в пуле потоков."""
+
+    def __init__(
+        self,
+        sources: list[CalendarSource],
+        poll_fn: Callable[[CalendarSource], PollResult],
+        max_workers: int,
+        debounce_seconds: float = 5.0,
+    ):
+        self.sources = sources
+        self._poll_fn = poll_fn
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="poll")
+        self._debounce = debounce_seconds
+        self._lock = threading.Lock()
+
+    def request_sync(self, name: str | None = None) -> int:
+        """Запросить внеочередной опрос календаря ``name`` (None — всех); вернуть число затронутых."""
+        now = time.monotonic()
+        matched = 0
+        with self._lock:
+            for source in self.sources:
+                if name and source.name != name:
+                    continue
+                if source.sync_first_requested is None:
+                    source.sync_first_requested = now
+                source.sync_last_requested = now
+                matched += 1
+        return matched
+
+    def _sync_due_at(self, source: CalendarSource) -> float | None:
+        """Когда выполнить запрошенную синхронизацию (с учётом debounce)."""
+        if source.sync_first_requested is None:
+            return None
+        return min(
+            source.sync_last_requested + self._debounce,
+            source.sync_first_requested + self._debounce * _MAX_DEBOUNCE_FACTOR,
+        )
+
+    def _run(self, source: CalendarSource) -> None:
+        try:
+            source.result = self._poll_fn(source)
+            source.error_count = 0
+        except Exception as e:  # noqa: BLE001
+            source.error_count += 1
+            logger.error(f"[{source.name}] Poll failed ({source.error_count} in a row): {e}", exc_info=True)
+        finally:
+            source.finished_at = time.monotonic()
+
+    def _finish(self, source: CalendarSource) -> None:
+        """Обработать завершившийся опрос и назначить следующий."""
+        elapsed = source.finished_at - source.started_at
+        source.future = None
+        source.overdue_logged = False
+        next_lesson_start = source.result.next_lesson_start if source.result else None
+        delay = next_poll_delay(source.policy, datetime.now(timezone.utc), next_lesson_start, source.error_count)
+        source.next_run = source.finished_at + delay
+        changes = (
+            f", {source.result.changed_lessons} changed lesson(s), {source.result.scheduled_items} queued item(s)"
+            if source.result and source.error_count == 0
+            else ""
+        )
+        logger.info(f"[{source.name}] Poll finished in {elapsed:.1f}s{changes}, next in {delay:.0f}s")
+
+    def tick(self) -> float:
+        """Запустить наступившие опросы; вернуть время до следующего события (сек)."""
+        now = time.monotonic()
+        delay = 1.0
+        for source in self.sources:
+            if source.future is not None:
+                if source.future.done():
+                    self._finish(source)
+                else:
+                    if now - source.started_at > source.timeout_seconds and not source.overdue_logged:
+                        logger.warning(
+                            f"[{source.name}] Poll is running longer than {source.timeout_seconds}s; "
+                            "skipping its next runs until it finishes"
+                        )
+                        source.overdue_logged = True
+                    continue
+            with self._lock:
+                sync_due = self._sync_due_at(source)
+                if sync_due is not None and now >= sync_due:
+                    # Запросы, пришедшие во время этого опроса, вызовут ещё один
+                    source.sync_first_requested = source.sync_last_requested = None
+                    logger.info(f"[{source.name}] Sync requested, polling now")
+                    source.next_run = now
+            if now >= source.next_run:
+                source.started_at = now
+                source.future = self._pool.submit(self._run, source)
+            else:
+                delay = min(delay, source.next_run - now)
+                if sync_due is not None:
+                    delay = min(delay, sync_due - now)
+        return max(delay, 0.05)
+
+    def run_forever(self) -> None:
+        while True:
+            delay = self.tick()
+            running = [source.future for source in self.sources if source.future is not None]
+            if running:
+                # Просыпаемся сразу, как только какой-нибудь опрос завершится
+                wait(running, timeout=delay, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(delay)
@@ -0,0 +1,157 @@
+"""Аренда элементов очереди и версии расписания (``app.due_queue``) на fakeredis."""
+import pytest
+
+from app import due_queue
+
+fakeredis = pytest.importorskip("fakeredis")
+
+NOW = 1_000_000.0
+LEASE = 60
+
+
+@pytest.fixture
+def r():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def _enqueue(r, member: str, score: float) -> None:
+    r.zadd(due_queue.DUE_QUEUE_KEY, {member: score})
+
+
+def _queued(r) -> dict[str, float]:
+    return dict(r.zrange(due_queue.DUE_QUEUE_KEY, 0, -1, withscores=True))
+
+
+def _inflight(r) -> dict[str, float]:
+    return dict(r.zrange(due_queue.INFLIGHT_KEY, 0, -1, withscores=True))
+
+
+def _set_version(r, kind: str, lesson_id: int) -> int:
+    (version,) = due_queue.next_versions(r, 1)
+    r.hset(due_queue.SCHEDULE_VERSIONS_KEY, due_queue.version_field(kind, lesson_id), version)
+    return version
+
+
+def test_pop_due_leases_only_due_items(r):
+    _enqueue(r, "notify:1:1", NOW - 10)
+    _enqueue(r, "notify:2:2", NOW)
+    _enqueue(r, "notify:3:3", NOW + 10)
+
+    items = due_queue.pop_due(r, NOW, limit=10, lease_seconds=LEASE)
+
+    assert items == [("notify:1:1", NOW - 10), ("notify:2:2", NOW)]
+    assert _queued(r) == {"notify:3:3": NOW + 10}
+    assert _inflight(r) == {"notify:1:1": NOW + LEASE, "notify:2:2": NOW + LEASE}
+
+
+def test_pop_due_respects_limit(r):
+    for i in range(5):
+        _enqueue(r, f"notify:{i}:{i}", NOW - i)
+
+    assert len(due_queue.pop_due(r, NOW, limit=2, lease_seconds=LEASE)) == 2
+    assert len(_queued(r)) == 3 and len(_inflight(r)) == 2
+
+
+def test_ack_releases_lease(r):
+    _enqueue(r, "notify:1:1", NOW)
+    items = due_queue.pop_due(r, NOW, limit=10, lease_seconds=LEASE)
+
+    due_queue.ack(r, items)
+
+    assert _queued(r) == {} and _inflight(r) == {}
+    assert due_queue.requeue_expired(r, NOW + LEASE + 1) == 0
+
+
+def test_requeue_restores_original_score(r):
+    _enqueue(r, "notify:1:1", NOW - 5)
+    items = due_queue.pop_due(r, NOW, limit=10, lease_seconds=LEASE)
+
+    due_queue.requeue(r, items)
+
+    assert _queued(r) == {"notify:1:1": NOW - 5}
+    assert _inflight(r) == {}
+
+
+def test_requeue_expired_returns_only_expired_leases(r):
+    _enqueue(r, "notify:1:1", NOW)
+    due_queue.pop_due(r, NOW, limit=10, lease_seconds=LEASE)
+    _enqueue(r, "notify:2:2", NOW + 30)
+    due_queue.pop_due(r, NOW + 30, limit=10, lease_seconds=LEASE)
+
+    assert due_queue.requeue_expired(r, NOW + LEASE) == 1
+
+    assert _queued(r) == {"notify:1:1": NOW + LEASE}
+    assert _inflight(r) == {"notify:2:2": NOW + 30 + LEASE}
+
+
+def test_requeue_expired_keeps_item_queued_again_by_worker(r):
+    _enqueue(r, "notify:1:1", NOW)
+    due_queue.pop_due(r, NOW, limit=10, lease_seconds=LEASE)
+    # Пока элемент был в аренде, worker поставил его снова на более позднее время
+    _enqueue(r, "notify:1:1", NOW + 3600)
+
+    assert due_queue.requeue_expired(r, NOW + LEASE) == 1
+
+    assert _queued(r) == {"notify:1:1": NOW + 3600}
+    assert _inflight(r) == {}
+
+
+def test_next_versions_never_repeat(r):
+    first = due_queue.next_versions(r, 3)
+    second = due_queue.next_versions(r, 2)
+
+    assert first == [1, 2, 3] and second == [4, 5]
+    assert due_queue.next_versions(r, 0) == []
+
+
+def test_stale_version_is_rejected(r):
+    old = _set_version(r, "notify", 1)
+    new = _set_version(r, "notify", 1)
+
+    assert not due_queue.is_current_version(r, "notify", 1, old)
+    assert due_queue.is_current_version(r, "notify", 1, new)
+    assert due_queue.current_versions(r, "notify", [(1, old), (1, new)]) == [(1, new)]
+
+
+def test_missing_field_rejects_versioned_task(r):
+    assert not due_queue.is_current_version(r, "notify", 1, 7)
+    # Задачи без версии (поставленные до появления версий) выполняются
+    assert due_queue.is_current_version(r, "notify", 1, None)
+
+    _set_version(r, "notify", 1)
+    assert not due_queue.is_current_version(r, "notify", 1, None)
+
+
+def test_consume_deletes_only_current_version(r):
+    old = _set_version(r, "notify", 1)
+    new = _set_version(r, "notify", 1)
+    current = _set_version(r, "notify", 2)
+
+    assert due_queue.consume_versions(r, "notify", [(1, old), (2, current)]) == 1
+
+    assert due_queue.is_current_version(r, "notify", 1, new)
+    assert r.hget(due_queue.SCHEDULE_VERSIONS_KEY, due_queue.version_field("notify", 2)) is None
+
+
+def test_version_is_not_reused_after_consume(r):
+    version = _set_version(r, "notify", 1)
+    due_queue.consume_versions(r, "notify", [(1, version)])
+
+    # Урок перепланирован после выполнения задачи: её версия не должна ожить
+    rescheduled = _set_version(r, "notify", 1)
+
+    assert rescheduled != version
+    assert not due_queue.is_current_version(r, "notify", 1, version)
+    assert due_queue.is_current_version(r, "notify", 1, rescheduled)
+
+
+def test_forget_lessons_drops_all_kinds(r):
+    notify = _set_version(r, "notify", 1)
+    _set_version(r, "deduct", 1)
+    other = _set_version(r, "notify", 2)
+
+    due_queue.forget_lessons(r, [1])
+
+    assert not due_queue.is_current_version(r, "notify", 1, notify)
+    assert r.hlen(due_queue.SCHEDULE_VERSIONS_KEY) == 1
+    assert due_queue.is_current_version(r, "notify", 2, other)
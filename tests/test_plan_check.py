@@ -0,0 +1,39 @@
+"""Горячие запросы читают таблицы по индексу (``app.plan_check``)."""
+from datetime import datetime, timedelta, timezone
+
+from app import models
+from app.plan_check import check_plans
+
+
+def test_hot_queries_use_indexes(db, db_engine):
+    now = datetime.now(timezone.utc)
+    students = [models.Student(summary=f"Ученик {i:02d}", paid_lessons_count=i) for i in range(20)]
+    db.add_all(students)
+    db.flush()
+    for i, student in enumerate(students):
+        db.add(models.TgLink(tg_user_id=str(1000 + i), student_id=student.id))
+        db.add_all([
+            models.Lesson(
+                event_uid=f"uid-{i}-{offset}",
+                summary=f"Урок {i}",
+                start=now + timedelta(hours=offset),
+                end=now + timedelta(hours=offset + 1),
+                is_paid=offset > 0,
+                student_id=student.id,
+            )
+            for offset in (-72, -3, 5, 30)
+        ])
+    db.commit()
+
+    with db_engine.connect() as conn:
+        plans = check_plans(conn)
+
+    assert set(plans) == {
+        "upcoming lessons",
+        "lessons for student",
+        "links for student",
+        "student by tg user",
+        "lessons to settle",
+        "overdue unpaid lessons",
+        "student prefix search",
+    }
@@ -0,0 +1,82 @@
+"""Число SQL-запросов горячих чтений бота (``app.query_guard.count_queries``)."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+
+from app import async_crud, models
+from app.query_guard import QueryCountExceeded, count_queries
+
+
+def _seed(db, students: int = 5, lessons: int = 10) -> list[int]:
+    """Ученики с двумя привязками Telegram и предстоящие уроки; возвращает id уроков."""
+    now = datetime.now(timezone.utc)
+    rows = [models.Student(summary=f"Ученик {i:02d}", paid_lessons_count=1) for i in range(students)]
+    db.add_all(rows)
+    db.flush()
+    for student in rows:
+        db.add_all([
+            models.TgLink(tg_user_id=str(1000 + student.id), student_id=student.id),
+            models.TgLink(tg_user_id=str(2000 + student.id), student_id=student.id),
+        ])
+    lesson_rows = [
+        models.Lesson(
+            event_uid=f"uid-{i}",
+            summary=f"Урок {i}",
+            start=now + timedelta(hours=i + 1),
+            end=now + timedelta(hours=i + 2),
+            student_id=rows[i % students].id,
+        )
+        for i in range(lessons)
+    ]
+    db.add_all(lesson_rows)
+    db.commit()
+    return [lesson.id for lesson in lesson_rows]
+
+
+def test_count_queries_raises_over_limit(db):
+    with pytest.raises(QueryCountExceeded):
+        with count_queries(db.get_bind(), max_queries=1):
+            db.execute(select(1))
+            db.execute(select(2))
+
+
+def test_upcoming_lessons_is_one_query(db, run_async):
+    _seed(db)
+
+    async def check(session, engine):
+        with count_queries(engine, max_queries=1):
+            lessons = await async_crud.get_upcoming_lessons(session, limit=10)
+            # Ученики загружены тем же запросом
+            return [(lesson.summary, lesson.student.summary) for lesson in lessons]
+
+    assert len(run_async(check)) == 10
+
+
+def test_lessons_notification_is_one_query(db, run_async):
+    lesson_ids = _seed(db)
+
+    async def check(session, engine):
+        with count_queries(engine, max_queries=1):
+            lessons = await async_crud.get_lessons_notification(session, lesson_ids)
+            return [len(lesson.student.tg_links) for lesson in lessons]
+
+    assert run_async(check) == [2] * len(lesson_ids)
+
+
+def test_students_page_is_one_query_and_then_cached(db, run_async):
+    _seed(db, students=12)
+
+    async def check(session, engine):
+        with count_queries(engine, max_queries=1):
+            first = await async_crud.list_students_page(session, limit=5)
+        with count_queries(engine, max_queries=1):
+            second = await async_crud.list_students_page(session, limit=5, cursor_id=first.students[-1].id)
+        with count_queries(engine, max_queries=0):
+            cached = await async_crud.list_students_page(session, limit=5)
+        return first, second, cached
+
+    first, second, cached = run_async(check)
+    assert len(first.students) == 5 and first.has_next and not first.has_prev
+    assert second.has_prev and not {s.id for s in second.students} & {s.id for s in first.students}
+    assert cached == first
@@ -0,0 +1,155 @@
+"""Списание за завершённые уроки (``crud.settle_completed_lessons``)."""
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+from app import crud, models
+from app.db import SessionLocal
+
+LOOKBACK = timedelta(hours=48)
+
+
+def _student(db, summary: str, paid: int) -> int:
+    student = models.Student(summary=summary, paid_lessons_count=paid)
+    db.add(student)
+    db.commit()
+    return student.id
+
+
+def _ended_lessons(db, student_id, count: int, ended_hours_ago: float = 1) -> list[int]:
+    """Завершившиеся неоплаченные уроки; раньше заканчиваются уроки с меньшим номером."""
+    now = datetime.now(timezone.utc)
+    lessons = []
+    for i in range(count):
+        end = now - timedelta(hours=ended_hours_ago) - timedelta(minutes=count - i)
+        lessons.append(models.Lesson(
+            event_uid=f"uid-{student_id}-{ended_hours_ago}-{i}",
+            summary=f"Урок {i}",
+            start=end - timedelta(hours=1),
+            end=end,
+            is_paid=False,
+            student_id=student_id,
+        ))
+    db.add_all(lessons)
+    db.commit()
+    return [lesson.id for lesson in lessons]
+
+
+def _balance(db, student_id: int) -> int:
+    db.expire_all()
+    return db.scalar(select(models.Student.paid_lessons_count).where(models.Student.id == student_id))
+
+
+def _unpaid(db) -> set[int]:
+    db.expire_all()
+    return set(db.scalars(select(models.Lesson.id).where(models.Lesson.is_paid.is_not(True))))
+
+
+def test_rerun_does_not_deduct_twice(db):
+    student_id = _student(db, "Анна", paid=5)
+    lesson_ids = _ended_lessons(db, student_id, 2)
+
+    first = crud.settle_completed_lessons(db, LOOKBACK, limit=100)
+    second = crud.settle_completed_lessons(db, LOOKBACK, limit=100)
+
+    assert sorted(first.lesson_ids) == sorted(lesson_ids)
+    assert first.deducted == {student_id: 2}
+    assert second.lesson_ids == [] and second.deducted == {}
+    assert _balance(db, student_id) == 3
+    assert _unpaid(db) == set()
+
+
+def test_partial_balance_reports_exhausted(db):
+    student_id = _student(db, "Борис", paid=1)
+    _ended_lessons(db, student_id, 3)
+
+    result = crud.settle_completed_lessons(db, LOOKBACK, limit=100)
+
+    assert result.deducted == {student_id: 1}
+    # Первый по времени урок оплачен, за два следующих занятий не хватило
+    assert result.exhausted == [("Борис", ["Урок 1", "Урок 2"])]
+    assert _balance(db, student_id) == 0
+    assert _unpaid(db) == set()
+
+
+def test_zero_balance_stays_zero(db):
+    student_id = _student(db, "Вера", paid=0)
+    _ended_lessons(db, student_id, 1)
+
+    result = crud.settle_completed_lessons(db, LOOKBACK, limit=100)
+
+    assert result.deducted == {}
+    assert result.exhausted == [("Вера", ["Урок 0"])]
+    assert _balance(db, student_id) == 0
+
+
+def test_lessons_without_student_are_marked_paid(db):
+    lesson_ids = _ended_lessons(db, None, 2)
+
+    result = crud.settle_completed_lessons(db, LOOKBACK, limit=100)
+
+    assert sorted(result.lesson_ids) == sorted(lesson_ids)
+    assert result.student_ids == set()
+    assert result.deducted == {} and result.exhausted == []
+    assert _unpaid(db) == set()
+
+
+def test_locked_lessons_are_skipped(db):
+    student_id = _student(db, "Глеб", paid=5)
+    locked_id, free_id = _ended_lessons(db, student_id, 2)
+
+    # Другая транзакция (параллельный запуск) держит блокировку первого урока
+    with SessionLocal() as other:
+        other.execute(select(models.Lesson.id).where(models.Lesson.id == locked_id).with_for_update())
+        result = crud.settle_completed_lessons(db, LOOKBACK, limit=100)
+        other.rollback()
+
+    assert result.lesson_ids == [free_id]
+    assert _unpaid(db) == {locked_id}
+
+    result = crud.settle_completed_lessons(db, LOOKBACK, limit=100)
+    assert result.lesson_ids == [locked_id]
+    assert _balance(db, student_id) == 3
+
+
+def test_concurrent_runs_settle_each_lesson_once(db):
+    student_id = _student(db, "Дина", paid=50)
+    lesson_ids = _ended_lessons(db, student_id, 20)
+    barrier = threading.Barrier(4)
+    results = []
+
+    def run():
+        with SessionLocal() as session:
+            barrier.wait()
+            results.append(crud.settle_completed_lessons(session, LOOKBACK, limit=5))
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    settled = [lesson_id for result in results for lesson_id in result.lesson_ids]
+    assert len(settled) == len(set(settled))
+    assert sum(result.deducted.get(student_id, 0) for result in results) == len(settled)
+    assert _balance(db, student_id) == 50 - len(settled)
+
+    # Остаток добирают следующие запуски, повторно ничего не списывается
+    while crud.settle_completed_lessons(db, LOOKBACK, limit=5).lesson_ids:
+        pass
+    assert _unpaid(db) == set()
+    assert _balance(db, student_id) == 50 - len(lesson_ids)
+
+
+def test_lessons_older_than_lookback_are_reported_not_settled(db):
+    student_id = _student(db, "Ева", paid=5)
+    old_ids = _ended_lessons(db, student_id, 2, ended_hours_ago=LOOKBACK.total_seconds() / 3600 + 24)
+
+    result = crud.settle_completed_lessons(db, LOOKBACK, limit=100)
+
+    assert result.lesson_ids == []
+    assert _unpaid(db) == set(old_ids)
+    assert _balance(db, student_id) == 5
+    # Последний по времени окончания — первым
+    assert crud.find_overdue_unpaid_lessons(db, LOOKBACK) == (2, ["Урок 1", "Урок 0"])